@@ -0,0 +1,42 @@
+import { decodePackedDetections, sanitizeDetections } from 'util/motionModel/packaging';
+
+// Fixtures produced by python/sqlite.py, for the same detections:
+//   encode_detections(detections, 'packed') / encode_detections(detections, 'json')
+// with detections = [([12, 340, 96, 402], 0.875, 0), ([-3, 0, 2027, 1023], 0.3125, 1), ([500, 600, 512, 640], 0.5, 2)]
+// The scores are exact in float16, so both encodings have to decode to the same values.
+const PACKED = Buffer.from('REVUAQMADABUAWAAkgEAADv9/wAA6wf/AwEANfQBWAIAAoACAgA4', 'base64');
+const JSON_ENCODED = '[[[12, 340, 96, 402], 0.875, 0], [[-3, 0, 2027, 1023], 0.3125, 1], [[500, 600, 512, 640], 0.5, 2]]';
+// encode_detections([], 'packed')
+const PACKED_EMPTY = Buffer.from('REVUAQAA', 'base64');
+// encode_detections([([1, 2, 3, 4], 0.2, 3)], 'packed'), 0.2 isn't representable in float16
+const PACKED_ROUNDED = Buffer.from('REVUAQEAAQACAAMABAADZjI=', 'base64');
+
+describe('packed ml_detections', () => {
+  it('decodes to the same detections as the JSON encoding', () => {
+    expect(decodePackedDetections(PACKED)).toEqual(JSON.parse(JSON_ENCODED));
+  });
+
+  it('sanitizes packed and JSON detections alike', () => {
+    expect(sanitizeDetections(PACKED)).toEqual(sanitizeDetections(JSON_ENCODED));
+    expect(sanitizeDetections(PACKED)).toEqual([
+      ['face', 12, 340, 96, 402, 0.875],
+      ['person', 0, 0, 2027, 1023, 0.3125],
+      ['license-plate', 500, 600, 512, 640, 0.5],
+    ]);
+  });
+
+  it('decodes an empty list', () => {
+    expect(decodePackedDetections(PACKED_EMPTY)).toEqual([]);
+  });
+
+  it('keeps scores within float16 precision', () => {
+    const [[box, score, classId]] = decodePackedDetections(PACKED_ROUNDED);
+    expect(box).toEqual([1, 2, 3, 4]);
+    expect(score).toBeCloseTo(0.2, 3);
+    expect(classId).toBe(3);
+  });
+
+  it('rejects buffers in another format', () => {
+    expect(() => decodePackedDetections(Buffer.from('[]'))).toThrow('Unsupported detections encoding');
+  });
+});
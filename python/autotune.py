@@ -0,0 +1,52 @@
+import os
+import threading
+import time
+import numpy as np
+
+# Startup self-benchmark for CPU backends: N inference workers with T runtime threads each
+# compete for the same cores, and which split is fastest depends on the model and the
+# board. Every combination that doesn't oversubscribe the cores runs a few concurrent
+# inferences, the one with the most inferences per second wins.
+
+def candidates(cpus):
+    counts = [1]
+    while counts[-1] * 2 <= cpus:
+        counts.append(counts[-1] * 2)
+    return [(workers, threads) for workers in counts for threads in counts if workers * threads <= cpus]
+
+def measure(backend_class, path, backend_options, workers, threads, runs):
+    # inferences per second of `workers` backends with `threads` threads each, running at once
+    backends = [backend_class(path, **dict(backend_options, num_threads=threads)) for _ in range(workers)]
+    for backend in backends:
+        backend.warmup()
+    tensor = np.zeros(backends[0].input_shape, dtype=backends[0].input_dtype)
+    errors = []
+
+    def run(backend):
+        try:
+            for _ in range(runs):
+                backend.infer(tensor)
+        except Exception as e:
+            errors.append(e)
+
+    pool = [threading.Thread(target=run, args=(backend,)) for backend in backends]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return workers * runs / elapsed
+
+def autotune(backend_class, path, backend_options, runs=3, cpus=None):
+    # returns (workers, threads, metric rows), metric rows hold the ms per inference of every combination
+    started = int(time.time() * 1000)
+    results = {}
+    for workers, threads in candidates(cpus or os.cpu_count() or 1):
+        results[(workers, threads)] = measure(backend_class, path, backend_options, workers, threads, runs)
+        print(f'Autotune {workers} workers x {threads} threads: {results[(workers, threads)]:.2f} inferences/s')
+    workers, threads = max(results, key=results.get)
+    rows = [('ml_autotune', f'{w}x{t}', started, int(1000 / rate)) for (w, t), rate in results.items()]
+    return workers, threads, rows
@@ -0,0 +1,244 @@
+import numpy as np
+import queue
+import threading
+
+# Inference backends for the detector core (see detector.py). A backend wraps one loaded
+# model and is owned by a single inference thread, unless it's `shared`: then one instance
+# per model serves all of them. Runtimes are imported on load, so only the one in use has
+# to be installed.
+#
+# input_shape / input_dtype describe the tensor infer() expects, `layout` is 'nchw' or
+# 'nhwc' and `normalize` tells whether pixels are scaled to 0..1. Quantized inputs set
+# `quantization` to their (scale, zero_point) instead. infer() returns the raw YOLOv8 head
+# as a float (4 + num_classes, num_anchors) array.
+
+class CompletedInference:
+    # handle returned by submit() for backends that run synchronously
+    def __init__(self, output):
+        self.output = output
+
+    def wait(self):
+        return self.output
+
+class Backend:
+    layout = 'nhwc'
+    normalize = True
+    quantization = None
+    # thread-safe backends are loaded once per model and used by every inference thread
+    shared = False
+    # error message fragments (lower case) after which the model has to be re-created
+    reload_errors = ()
+    # takes num_threads, so autotune.py can pick the runtime threads per worker
+    tunable = False
+
+    def __init__(self, path):
+        self.path = path
+        self.input_shape = None
+        self.input_dtype = None
+        # bumped on every reload, so threads failing on the same broken state reload only once
+        self.generation = 0
+        self.reload_lock = threading.Lock()
+        self.load()
+
+    @classmethod
+    def options(cls, config):
+        # constructor options taken from the privacy config
+        return {}
+
+    def reload(self, generation):
+        with self.reload_lock:
+            if generation == self.generation:
+                self.load()
+                self.warmup()
+                self.generation += 1
+
+    def load(self):
+        raise NotImplementedError
+
+    def warmup(self, runs=1):
+        # the first invocations allocate and compile, keep that out of the frame latencies
+        tensor = np.zeros(self.input_shape, dtype=self.input_dtype)
+        for _ in range(runs):
+            self.infer(tensor)
+
+    def input_buffer(self):
+        # a buffer infer() can read without copying, when the runtime exposes one
+        return None
+
+    def infer(self, tensor):
+        raise NotImplementedError
+
+    def submit(self, tensor):
+        # asynchronous variant of infer(), wait() on the handle returns the output
+        return CompletedInference(self.infer(tensor))
+
+    @classmethod
+    def should_reload(cls, error):
+        message = str(error).lower()
+        return any(fragment in message for fragment in cls.reload_errors)
+
+class TFLiteBackend(Backend):
+    layout = 'nhwc'
+    normalize = True
+    reload_errors = ('inference', 'interpreter')
+    tunable = True
+
+    def __init__(self, path, num_threads=0, xnnpack=True):
+        # num_threads 0 leaves the thread count to the runtime
+        self.num_threads = num_threads
+        self.xnnpack = xnnpack
+        super().__init__(path)
+
+    @classmethod
+    def options(cls, config):
+        return {'num_threads': config["PrivacyTfliteThreads"], 'xnnpack': config["PrivacyTfliteXnnpack"]}
+
+    def load(self):
+        from tflite_runtime import interpreter
+        options = {'num_threads': self.num_threads or None}
+        if not self.xnnpack:
+            # XNNPACK is applied as the runtime's default delegate
+            options['experimental_op_resolver_type'] = interpreter.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        # loading from the path mmaps the model file, so all interpreters share its pages
+        self.model = interpreter.Interpreter(model_path=self.path, **options)
+        self.model.allocate_tensors()
+        input_details = self.model.get_input_details()[0]
+        output_details = self.model.get_output_details()[0]
+        self.input_index = input_details['index']
+        self.output_index = output_details['index']
+        self.input_shape = tuple(input_details['shape'])
+        self.input_dtype = input_details['dtype']
+        self.normalize = True
+        self.quantization = None
+        if np.issubdtype(self.input_dtype, np.integer):
+            # fully quantized model, picked up per model from its input tensor
+            scale, zero_point = input_details['quantization']
+            self.normalize = False
+            if not (self.input_dtype == np.uint8 and zero_point == 0 and np.isclose(scale * 255, 1)):
+                # anything but raw 0..255 pixels has to be quantized while building the mosaic
+                self.quantization = (scale, zero_point)
+        self.output_quantization = None
+        if np.issubdtype(output_details['dtype'], np.integer):
+            self.output_quantization = output_details['quantization']
+
+    def input_buffer(self):
+        # view of the interpreter's own input tensor, must not be held across invoke()
+        return self.model.tensor(self.input_index)()
+
+    def infer(self, tensor):
+        if tensor is not None:
+            np.copyto(self.input_buffer(), tensor)
+        self.model.invoke()
+        output = self.model.get_tensor(self.output_index)[0]
+        if self.output_quantization is not None:
+            scale, zero_point = self.output_quantization
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+class OpenVINOBackend(Backend):
+    # One imported network per model, shared by all inference threads. Each inference takes
+    # an async infer request from a pool, so while the VPU runs one mosaic the other threads
+    # can already queue theirs instead of serializing on a blocking infer() per thread.
+    layout = 'nchw'
+    normalize = False
+    shared = True
+    reload_errors = ('vpualcorennexecutor', 'nnxlinkplg')
+    device = 'VPUX'
+
+    def __init__(self, path, num_requests=4):
+        self.num_requests = num_requests
+        super().__init__(path)
+
+    @classmethod
+    def options(cls, config):
+        # one request per inference thread, so none of them waits for a free request
+        return {'num_requests': config["PrivacyNumThreads"]}
+
+    def load(self):
+        from openvino.inference_engine import IECore
+        # the legacy API only creates infer requests on import, so a reload re-imports once for everyone
+        self.session = IECore().import_network(model_file=self.path, device_name=self.device, num_requests=self.num_requests)
+        self.input_blob = next(iter(self.session.input_info))
+        input_info = self.session.input_info[self.input_blob]
+        # dims are reported in NCHW order, whatever the blob's layout
+        n, c, h, w = input_info.input_data.shape
+        if input_info.precision == 'U8':
+            # blob compiled with U8 NHWC input (compile_tool -ip U8 -il NHWC): the device converts
+            # layout and precision itself, the host only copies the mosaic's pixels in
+            self.layout = 'nhwc'
+            self.input_shape = (n, h, w, c)
+            self.input_dtype = np.uint8
+        else:
+            # FP16 NCHW blob, transposed and converted on the host
+            self.layout = 'nchw'
+            self.input_shape = (n, c, h, w)
+            self.input_dtype = np.float16
+        self.requests = queue.Queue()
+        for request in self.session.requests:
+            self.requests.put(request)
+
+    def infer(self, tensor):
+        return self.submit(tensor).wait()
+
+    def submit(self, tensor):
+        # blocks while all requests are busy
+        requests = self.requests
+        request = requests.get()
+        try:
+            if self.layout == 'nhwc':
+                # the blob's buffer is shaped by the NCHW dims but its memory is NHWC, copy it in flat
+                np.copyto(request.input_blobs[self.input_blob].buffer.reshape(tensor.shape), tensor)
+                request.async_infer()
+            else:
+                request.async_infer({self.input_blob: tensor})
+        except Exception:
+            requests.put(request)
+            raise
+        return OpenVINOInference(requests, request)
+
+class OpenVINOInference:
+    def __init__(self, requests, request):
+        # the pool the request came from, a reload replaces it rather than recycling old requests
+        self.requests = requests
+        self.request = request
+
+    def wait(self):
+        try:
+            status = self.request.wait()
+            if status != 0:
+                raise RuntimeError(f'Inference request failed with status {status}')
+            # the request's blob is reused by the next inference
+            return np.squeeze(self.request.output_blobs['output0'].buffer).copy()
+        finally:
+            self.requests.put(self.request)
+
+class ONNXBackend(Backend):
+    # CPU backend, runs the detector on an ordinary Linux box without the accelerator
+    normalize = True
+    tunable = True
+    TYPES = {'tensor(float)': np.float32, 'tensor(float16)': np.float16}
+
+    def __init__(self, path, num_threads=0):
+        self.num_threads = num_threads
+        super().__init__(path)
+
+    def load(self):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.num_threads
+        self.session = onnxruntime.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # symbolic (batch) dimensions are run with a single mosaic
+        self.input_shape = tuple(dim if isinstance(dim, int) else 1 for dim in model_input.shape)
+        self.input_dtype = self.TYPES[model_input.type]
+        self.layout = 'nchw' if self.input_shape[1] == 3 else 'nhwc'
+
+    def infer(self, tensor):
+        return self.session.run(None, {self.input_name: tensor})[0][0]
+
+BACKENDS = {
+    'tflite': TFLiteBackend,
+    'openvino': OpenVINOBackend,
+    'onnx': ONNXBackend,
+}
@@ -0,0 +1,46 @@
+import argparse
+import os
+import tempfile
+import time
+import cv2
+import numpy as np
+from image import encode_jpeg, write_jpeg, commit_files, turbo_jpeg
+
+# Compares the JPEG encoder backends on a frame, e.g.
+# python3 bench_jpeg.py --image /data/recording/pic/<frame>.jpg --runs 20
+
+def bench(img, encoder, quality, runs, fsync, directory):
+  encode_ms = []
+  write_ms = []
+  size = 0
+  for i in range(runs):
+    start = time.perf_counter()
+    size = len(encode_jpeg(img, quality, encoder))
+    encode_ms.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    commit_files([write_jpeg(img, os.path.join(directory, f'{encoder}_{i}.jpg'), quality, encoder)], fsync)
+    write_ms.append((time.perf_counter() - start) * 1000)
+  return np.median(encode_ms), np.median(write_ms), size
+
+def main(image_path, quality, runs, fsync):
+  if image_path:
+    img = cv2.imread(image_path)
+  else:
+    # smooth noise, compresses roughly like a road scene
+    img = cv2.GaussianBlur((np.random.default_rng(0).random((1024, 2028, 3)) * 255).astype(np.uint8), (15, 15), 4)
+
+  encoders = ['pil', 'cv2'] + (['turbojpeg'] if turbo_jpeg is not None else [])
+  with tempfile.TemporaryDirectory() as directory:
+    for encoder in encoders:
+      encode_ms, write_ms, size = bench(img, encoder, quality, runs, fsync, directory)
+      print(f'{encoder:10} encode {encode_ms:7.2f}ms  encode+write {write_ms:7.2f}ms  {size / 1024:7.1f}KB')
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--image', type=str, default=None)
+  parser.add_argument('--quality', type=int, default=80)
+  parser.add_argument('--runs', type=int, default=20)
+  parser.add_argument('--fsync', action='store_true')
+  args = parser.parse_args()
+  main(args.image, args.quality, args.runs, args.fsync)
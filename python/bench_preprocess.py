@@ -0,0 +1,55 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import cv2
+import numpy as np
+from detector import combine_images
+
+# Compares building a 1x2 mosaic for the model input modes, e.g.
+# python3 bench_preprocess.py --image /data/recording/pic/<frame>.jpg
+# OpenVINO: the FP16 NCHW blob (transpose and float conversion on the host) and a U8 NHWC
+# blob (plain pixel copy, the VPU converts). TFLite: the float models (pixels / 255) and
+# fully quantized uint8 / int8 ones.
+
+MODES = {
+  # dtype, layout, normalize, quantization
+  'fp16 nchw': (np.float16, 'nchw', False, None),
+  'u8 nhwc': (np.uint8, 'nhwc', False, None),
+  'f32 nhwc': (np.float32, 'nhwc', True, None),
+  'int8 nhwc': (np.int8, 'nhwc', False, (1 / 255, -128)),
+}
+
+def bench(images, model_size, dtype, layout, normalize, quantization, runs, directory):
+  shape = (1, 3, model_size, model_size) if layout == 'nchw' else (1, model_size, model_size, 3)
+  out = np.zeros(shape, dtype=dtype)
+  times = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    combine_images(images, 1, model_size, out, layout, normalize, directory, quantization)
+    times.append((time.perf_counter() - start) * 1000)
+  return np.median(times), out.nbytes
+
+def main(image_path, model_size, runs):
+  with tempfile.TemporaryDirectory() as directory:
+    # two frames named like old ones, so they're read from `directory` instead of the RAM path
+    images = [(f'{i}_bench.jpg', directory, 0, 0, 1) for i in range(2)]
+    for name, _, _, _, _ in images:
+      if image_path:
+        shutil.copy(image_path, os.path.join(directory, name))
+      else:
+        img = cv2.GaussianBlur((np.random.default_rng(0).random((1024, 2028, 3)) * 255).astype(np.uint8), (15, 15), 4)
+        cv2.imwrite(os.path.join(directory, name), img)
+
+    for mode, (dtype, layout, normalize, quantization) in MODES.items():
+      ms, size = bench(images, model_size, dtype, layout, normalize, quantization, runs, directory)
+      print(f'{mode:10} combine {ms:7.2f}ms  input {size / 1024 / 1024:5.2f}MB')
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--image', type=str, default=None)
+  parser.add_argument('--model_size', type=int, default=640)
+  parser.add_argument('--runs', type=int, default=20)
+  args = parser.parse_args()
+  main(args.image, args.model_size, args.runs)
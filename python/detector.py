@@ -0,0 +1,666 @@
+import argparse
+import cv2
+import hashlib
+import numpy as np
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from sqlite import SQLite, ML_LEASE_MS
+from writer import ResultWriter
+from stage_metrics import StageMetrics
+from pipeline import Pipeline, Stage, BufferPool
+from yolov8.utils import decode_predictions
+import jpeg_blur
+from scheduler import GridScheduler
+from wakeup import Wakeup
+from mosaic import grid_layout, unmosaic, filter_boxes, rotate_boxes, group_by_cell
+from backends import BACKENDS
+from autotune import autotune
+import image
+from image import write_jpeg, commit_files
+
+# Detector core shared by detect.py (OpenVINO, HDC-S) and detect_hdc.py (TFLite, HDC):
+# frame claiming, the decode -> infer -> post-process pipeline, blur and result writes.
+# Only the inference backend (see backends.py) and the models differ per device.
+
+width = 2028
+height = 1024
+image_size_px = width * height
+
+# model running one mosaic layout; normalized_boxes means its boxes are 0..1 of the input size
+ModelSpec = namedtuple('ModelSpec', ['path', 'hash', 'normalized_boxes'])
+
+# seconds the watcher stops claiming after a model failed to load
+BACKEND_BACKOFF_S = 5
+
+class BackendUnavailable(Exception):
+  # a model couldn't be loaded, e.g. the accelerator isn't ready yet at boot.
+  # A service error, the frames of the group are released without a retry strike
+  pass
+
+def quantize_pixels(pixels, out, scale, zero_point):
+    # uint8 pixels into a quantized model input: q = pixel / 255 / scale + zero_point
+    if out.dtype == np.int8 and zero_point == -128 and np.isclose(scale * 255, 1):
+        # the common int8 input is the pixels shifted by 128, i.e. with the top bit flipped
+        np.bitwise_xor(pixels, 0x80, out=out.view(np.uint8))
+    else:
+        limits = np.iinfo(out.dtype)
+        np.copyto(out, np.clip(np.rint(pixels / (255 * scale) + zero_point), limits.min, limits.max), casting='unsafe')
+
+def combine_images(images, grid_size, model_size, out, layout, normalize, ram_path, quantization=None):
+    # Adjust the number of cells based on the grid size
+    if grid_size == 1:  # 1x2 grid
+        total_cells = 2  # Two cells stacked vertically
+        cell_width = model_size
+        cell_height = model_size // 2
+    else:  # 2x2 grid
+        total_cells = grid_size * grid_size
+        cell_width = cell_height = model_size // grid_size
+
+    # The grid is written straight into `out`, a reused input buffer in the model's layout
+    # only paths are kept, full-resolution frames are decoded later for the ones with detections
+    frame_paths = []
+
+    for i in range(total_cells):
+        # Calculate grid cell position
+        x_offset = (i % grid_size) * cell_width
+        y_offset = (i // grid_size) * cell_height
+
+        if i < len(images):
+            # If there's an image to put in the cell
+            img_path = image.get_path(images[i][0], images[i][1], ram_path)
+
+            # Read and resize image to fit in the grid cell
+            img = None
+            try: 
+              img = image.read_reduced(img_path, cell_width, cell_height, width, height)
+            except Exception as e:
+              try:
+                 img_path = os.path.join(images[i][1], images[i][0])
+                 img = image.read_reduced(img_path, cell_width, cell_height, width, height)
+              except Exception as err:
+                print(err)
+            
+            frame_paths.append(img_path if img is not None else None)
+            if img is None:
+              # if input img is broken or empty
+              resized_img = None
+            else:
+                resized_img = cv2.resize(img, (cell_width, cell_height), interpolation=cv2.INTER_NEAREST)
+                # Rotate the image if orientation is 3 (upside-down), as a view, the copy below does the work
+                if images[i][4] == 3:
+                    resized_img = resized_img[::-1, ::-1]
+        else:
+            # Use an empty (black) image for spots without images
+            resized_img = None
+
+        # Place resized image or empty cell in the grid
+        if layout == 'nchw':
+            cell = out[0, :, y_offset:y_offset + cell_height, x_offset:x_offset + cell_width]
+        else:
+            cell = out[0, y_offset:y_offset + cell_height, x_offset:x_offset + cell_width]
+        if resized_img is None:
+            # black, which for quantized inputs is the zero point (e.g. -128 for int8)
+            cell.fill(quantization[1] if quantization is not None else 0)
+        else:
+            # HWC -> CHW, the dtype conversion and normalization happen in this single pass
+            pixels = resized_img.transpose(2, 0, 1) if layout == 'nchw' else resized_img
+            if quantization is not None:
+                quantize_pixels(pixels, cell, *quantization)
+            elif normalize:
+                np.divide(pixels, 255, out=cell, dtype=cell.dtype, casting='unsafe')
+            else:
+                np.copyto(cell, pixels, casting='unsafe')
+
+    return out, frame_paths
+
+def prepare_group(job, model_input, buffers, ram_path):
+    # decode stage: read the group's frames and build the mosaic tensor in a pooled buffer
+    images = job['images']
+    input_shape, input_dtype, layout, normalize, quantization = model_input
+    model_size = input_shape[2] if layout == 'nchw' else input_shape[1]
+    start_read = time.perf_counter()
+    grid_size = 2 if len(images) > 2 else 1
+    print("grid", grid_size)
+    job['metrics'] = {'grid': grid_size}
+    job['grid_size'] = grid_size
+    job['model_size'] = model_size
+
+    tensor = buffers.acquire(input_shape, input_dtype)
+    try:
+      job['tensor'], job['frame_paths'] = combine_images(images, grid_size, model_size, tensor, layout, normalize, ram_path, quantization)
+    except Exception:
+      buffers.release(tensor)
+      raise
+    job['load_ms'] = (time.perf_counter() - start_read) * 1000
+    job['metrics']['load_time'] = int(job['load_ms'] / len(images))
+    return job
+
+def run_inference(job, backend):
+    # inference stage: the only step touching the accelerator
+    start_inference = time.perf_counter()
+    job['output'] = backend.infer(job.pop('tensor'))
+    job['inference_ms'] = (time.perf_counter() - start_inference) * 1000
+    job['metrics']['inference_time'] = int(job['inference_ms'] / len(job['images']))
+    return job
+
+def postprocess_group(job, conf_threshold, nms_threshold, writer, stage_metrics):
+    # post-process stage: decode predictions, NMS, blur, save frames and queue the results
+    images = job['images']
+    metrics = job['metrics']
+    grid_size = job['grid_size']
+    model_size = job['model_size']
+    frame_paths = job['frame_paths']
+    model_hash = job['model_hash']
+    blur_mode = job['config']["PrivacyBlurMode"]
+    jpeg_encoder = job['config']["PrivacyJpegEncoder"]
+    output = job.pop('output')
+    stage_metrics.record('load', job['load_ms'])
+    stage_metrics.record('infer', job['inference_ms'])
+    start_nms = time.perf_counter()
+
+    # normalized boxes are scaled back to model input pixels
+    predictions = decode_predictions(output, conf_threshold, model_size if job['normalized_boxes'] else 1)
+
+    boxes = []
+    scores = []
+    class_ids = []
+    if len(predictions) > 0:
+      # Perform Non-maximum suppression
+      indices = cv2.dnn.NMSBoxes(predictions[:, 2:6].tolist(), predictions[:, 1].tolist(), conf_threshold, nms_threshold)
+
+      # Extract the final predictions after NMS
+      final_predictions = predictions[indices.flatten()]
+      boxes = final_predictions[:, 2:6]
+      scores = final_predictions[:, 1].tolist()
+      class_ids = final_predictions[:, 0].astype(int).tolist()
+
+    stage_metrics.record('nms', (time.perf_counter() - start_nms) * 1000)
+
+    if len(scores) == 0:
+        writer.set_frames_ml([(image[0], model_hash, [], metrics) for image in images])
+        return job
+
+    total_images = 2 if grid_size == 1 else 4
+    columns, rows, cell_width, cell_height = grid_layout(model_size, grid_size)
+
+    # Split boxes between initial images
+    cell_index, frame_boxes = unmosaic(boxes, columns, rows, cell_width, cell_height, width, height)
+    scores = np.asarray(scores)
+    class_ids = np.asarray(class_ids)
+
+    # filter out large boxes and boxes on the hood
+    keep = filter_boxes(frame_boxes, scores, conf_threshold, width, height)
+    cell_index, frame_boxes, scores, class_ids = cell_index[keep], frame_boxes[keep], scores[keep], class_ids[keep]
+
+    # orientation 3 frames were rotated upright in the mosaic, so boxes are rotated back to blur the original frame
+    upside_down = np.array([image[4] == 3 for image in images] + [False] * (total_images - len(images)))
+    blur_boxes = np.where(upside_down[cell_index][:, np.newaxis], rotate_boxes(frame_boxes, width, height), frame_boxes)
+    grouped = group_by_cell(cell_index, total_images)
+
+    # apply blur, results for the whole group are written in one transaction
+    results = []
+    written = []
+    for i, image in enumerate(images):
+      # per-frame copy, so blur timings of one frame don't leak into the next one
+      frame_metrics = dict(metrics)
+      indices = grouped[i]
+      if len(indices) > 0:
+        if blur_mode == 'dct' and jpeg_blur.available():
+          # rewrite only the JPEG blocks under the boxes, the rest of the frame is copied through
+          start = time.perf_counter()
+          dst_path = os.path.join(image[1], image[0])
+          src_path = frame_paths[i] if frame_paths[i] and os.path.exists(frame_paths[i]) else dst_path
+          written.append(jpeg_blur.blur_file(src_path, dst_path, blur_boxes[indices]))
+          frame_metrics['blur_time'] = (time.perf_counter() - start) * 1000
+          stage_metrics.record('blur', frame_metrics['blur_time'])
+        else:
+          start = time.perf_counter()
+          # full-resolution decode only for frames with something to blur
+          orig = cv2.imread(frame_paths[i]) if frame_paths[i] else None
+          if orig is None:
+            # the RAM copy may be gone by now
+            orig = cv2.imread(os.path.join(image[1], image[0]))
+          frame_metrics['read_time'] = (time.perf_counter() - start) * 1000
+          start = time.perf_counter()
+          result, frame_metrics = blur(orig, blur_boxes[indices], frame_metrics)
+          frame_metrics['blur_time'] = (time.perf_counter() - start) * 1000
+          stage_metrics.record('blur', frame_metrics['blur_time'])
+          start = time.perf_counter()
+          written.append(write_jpeg(result, os.path.join(image[1], image[0]), 80, jpeg_encoder))
+          frame_metrics['write_time'] = (time.perf_counter() - start) * 1000
+          stage_metrics.record('encode', frame_metrics['write_time'])
+        detections = list(zip(frame_boxes[indices].tolist(), scores[indices].tolist(), class_ids[indices].tolist()))
+        results.append((image[0], model_hash, detections, frame_metrics))
+      else:
+        #set empty detections
+        results.append((image[0], model_hash, [], frame_metrics))
+    # frames are swapped in before their results are queued, so a processed row always has its blurred frame
+    commit_files(written, job['config']["PrivacyFsync"])
+    writer.set_frames_ml(results)
+    return job
+
+def blur(img, boxes, metrics):
+  blur_per_boxes = False
+  if len(boxes) < 30:
+    #calc box sizes to determine the optimal blur strategy
+    total_box_size = sum((box[2] - box[0]) * (box[3] - box[1]) for box in boxes)
+    if total_box_size < 0.5 * image_size_px:
+      blur_per_boxes = True
+
+  if blur_per_boxes:
+    for box in boxes:
+      box = box.astype(int)
+      roi = img[box[1]:box[3], box[0]:box[2]]
+      roi_downscale_width = int(roi.shape[1] * 0.2)
+      roi_downscale_height = int(roi.shape[0] * 0.2)
+      if roi_downscale_width > 0 and roi_downscale_height > 0:
+        #downscale
+        small_roi = cv2.resize(roi, (roi_downscale_width, roi_downscale_height), interpolation=cv2.INTER_NEAREST)
+        #blur
+        blurred_small_roi = cv2.GaussianBlur(small_roi, (5, 5), 1.5)
+        #upscale
+        blurred_roi = cv2.resize(blurred_small_roi, (roi.shape[1], roi.shape[0]), interpolation=cv2.INTER_NEAREST)
+        #apply
+        img[box[1]:box[3], box[0]:box[2]] = blurred_roi
+
+    return img, metrics
+  else:
+    #Downscale & blur
+    start = time.perf_counter()
+    downscale_size = (int(width * 0.2), int(height * 0.2))
+    img_downscaled = cv2.resize(img, downscale_size, interpolation=cv2.INTER_NEAREST)
+    img_blurred = cv2.GaussianBlur(img_downscaled, (5, 5), 1.5)
+    metrics['downscale_time'] = (time.perf_counter() - start) * 1000
+
+    # Upscale
+    start = time.perf_counter()
+    upscale_size = (width, height)
+    img_upscaled = cv2.resize(img_blurred, upscale_size, interpolation=cv2.INTER_NEAREST)
+    metrics['upscale_time'] = (time.perf_counter() - start) * 1000
+
+    # Mask from bounding boxes
+    start = time.perf_counter()
+    mask = np.zeros((height, width), dtype=np.uint8)
+
+    for box in boxes:
+      box = box.astype(int)
+      cv2.rectangle(mask, (box[0], box[1]), (box[2], box[3]), 255, -1)
+
+    metrics['mask_time'] = (time.perf_counter() - start) * 1000
+
+    # Composite
+    start = time.perf_counter()
+    composite_img = cv2.bitwise_and(img_upscaled, img_upscaled, mask=mask)
+    mask_inv = cv2.bitwise_not(mask)
+    img_unmasked = cv2.bitwise_and(img, img, mask=mask_inv)
+    result = cv2.add(composite_img, img_unmasked)
+    metrics['composite_time'] = (time.perf_counter() - start) * 1000
+
+    return result, metrics
+
+def run_detector(db_path, ram_path, backend_class, model_specs, backend_options=None, grid_conf_offset=0):
+  # model_specs(config) returns {grid_size: ModelSpec}, a device without a 2x2 model only gets 1x2 groups.
+  # 2x2 mosaics run with a confidence threshold lowered by grid_conf_offset
+
+  retry_counters = {}
+  # frames are leased under this owner, so other detector processes never pick them up concurrently
+  owner = f'{socket.gethostname()}:{os.getpid()}'
+  sqlite = SQLite(db_path)
+  # all detector writes go through a single write-behind thread
+  stage_metrics = StageMetrics()
+  writer = ResultWriter(sqlite, stage_metrics=stage_metrics)
+  config = sqlite.get_privacy_config()
+  sqlite.detections_encoding = config["PrivacyDetectionsEncoding"]
+  sqlite.per_frame_metrics = config["PrivacyPerFrameMetrics"]
+  print(config)
+  if config["PrivacyBlurMode"] == 'dct' and not jpeg_blur.available():
+    print('PrivacyBlurMode is dct but jpegio is not installed, using the pixel blur')
+
+  errors = {'count': 0}
+  # last time a job finished, for the stuck pipeline check in the watcher
+  progress = {'last': time.monotonic(), 'completed': 0, 'stuck_at': None, 'backoff_until': 0}
+  # runtime options from the config, applied when a backend is (re)loaded.
+  # Options passed by the caller win over the config ones
+  extra_options = dict(backend_options or {})
+  backend_options = dict(backend_class.options(config), **extra_options)
+  # worker and thread counts picked by the startup benchmark, they stay over config reloads.
+  # `configured` is the config table's version, reloads are detected against it
+  configured = dict(config)
+  tuned = {}
+  tuned_options = {}
+  if config["PrivacyAutotune"] and backend_class.tunable:
+    try:
+      workers, threads, rows = autotune(backend_class, model_specs(config)[1].path, backend_options)
+      print(f"Autotune picked {workers} inference workers x {threads} threads")
+      tuned['PrivacyNumThreads'] = workers
+      tuned_options['num_threads'] = threads
+      config.update(tuned)
+      backend_options.update(tuned_options)
+      writer.write_metrics(rows)
+    except Exception as e:
+      print(f"Autotune failed, keeping the configured threads. Error: {e}")
+  buffers = BufferPool()
+  # input description per model path, filled by the first backend loaded for it
+  model_inputs = {}
+  # backends loaded by the decode stage to learn a model's input, handed to the next inference thread
+  spare_backends = {}
+  model_inputs_lock = threading.Lock()
+
+  # backends every inference thread uses, one per model path
+  shared_backends = {}
+  shared_backends_lock = threading.Lock()
+
+  def load_backend(path):
+    if backend_class.shared:
+      with shared_backends_lock:
+        if path not in shared_backends:
+          shared_backends[path] = create_backend(path)
+        return shared_backends[path]
+    with model_inputs_lock:
+      spares = spare_backends.get(path)
+      if spares:
+        return spares.pop()
+    return create_backend(path)
+
+  def create_backend(path):
+    with model_inputs_lock:
+      entry = model_inputs.setdefault(path, {'ready': threading.Event()})
+    print(f"Loading {backend_class.__name__}: {path}")
+    try:
+      backend = backend_class(path, **backend_options)
+      backend.warmup()
+    except Exception as e:
+      with model_inputs_lock:
+        if not entry['ready'].is_set():
+          # let waiting decode threads fail instead of blocking, the next load retries
+          model_inputs.pop(path, None)
+          entry['ready'].set()
+      raise BackendUnavailable(f"Loading {path} failed: {e}") from e
+    if not entry['ready'].is_set():
+      entry['input'] = (backend.input_shape, backend.input_dtype, backend.layout, backend.normalize, backend.quantization)
+      entry['ready'].set()
+    return backend
+
+  def get_model_input(path):
+    with model_inputs_lock:
+      entry = model_inputs.get(path)
+    if entry is None:
+      # no thread loaded this model yet, load one for the inference stage to pick up
+      backend = load_backend(path)
+      with model_inputs_lock:
+        if not backend_class.shared:
+          spare_backends.setdefault(path, []).append(backend)
+        entry = model_inputs[path]
+    entry['ready'].wait()
+    if 'input' not in entry:
+      raise BackendUnavailable(f"Loading {path} failed")
+    return entry['input']
+
+  def decode_stage(job, context):
+    # snapshot, so a config reload in the watcher can't change values halfway through a group
+    job['config'] = cfg = dict(config)
+    spec = model_specs(cfg)[2 if len(job['images']) > 2 else 1]
+    job['model_path'] = spec.path
+    job['model_hash'] = spec.hash
+    job['normalized_boxes'] = spec.normalized_boxes
+    return prepare_group(job, get_model_input(spec.path), buffers, ram_path)
+
+  def get_backend(context, grid_size, path):
+    # models are only re-created when their path changes in the config
+    backends = context['backends']
+    if grid_size not in backends or backends[grid_size].path != path:
+      backends[grid_size] = load_backend(path)
+    return backends[grid_size]
+
+  def init_inference():
+    # each inference thread owns its backends, unless they are shared
+    context = {'backends': {}}
+    for grid_size, spec in model_specs(dict(config)).items():
+      get_backend(context, grid_size, spec.path)
+    return context
+
+  def inference_stage(job, context):
+    tensor = job['tensor']
+    backend = None
+    try:
+      backend = get_backend(context, job['grid_size'], job['model_path'])
+      generation = backend.generation
+      return run_inference(job, backend)
+    except Exception as e:
+      if not isinstance(e, BackendUnavailable) and backend_class.should_reload(e):
+        try:
+          if backend_class.shared and backend is not None:
+            # the other threads share this backend, the first one to fail reloads it for all
+            backend.reload(generation)
+          else:
+            context['backends'].clear()
+            for grid_size, spec in model_specs(job['config']).items():
+              get_backend(context, grid_size, spec.path)
+          time.sleep(2)
+        except Exception as err:
+          sqlite.set_service_status('failed')
+      raise e
+    finally:
+      # the runtime has its own copy by now
+      buffers.release(tensor)
+
+  def postprocess_stage(job, context):
+    cfg = job['config']
+    conf_threshold = cfg["PrivacyConfThreshold"]
+    conf = conf_threshold - grid_conf_offset if len(job['images']) > 2 else conf_threshold
+    return postprocess_group(job, conf, cfg["PrivacyNmsThreshold"], writer, stage_metrics)
+
+  def on_complete(job):
+    progress['last'] = time.monotonic()
+    progress['completed'] += 1
+    scheduler.record(job['grid_size'], job['inference_ms'])
+    for image in job['images']:
+      retry_counters.pop(image[0], None)
+
+  def on_error(job, error, stage):
+    progress['last'] = time.monotonic()
+    print(f"Error processing frames in {stage} stage. Error: {error}")
+    released = []
+    backend_unavailable = isinstance(error, BackendUnavailable)
+    if backend_unavailable:
+      # not the frames' fault, stop claiming for a while instead of burning their retries.
+      # The service is failed until a group completes again, see the watcher
+      progress['backoff_until'] = time.monotonic() + BACKEND_BACKOFF_S
+      if progress['stuck_at'] is None:
+        progress['stuck_at'] = progress['completed']
+        sqlite.set_service_status('failed')
+    for image in job['images']:
+      image_name = image[0]
+      print('failed: ' + image_name)
+      if backend_unavailable:
+        released.append(image_name)
+        continue
+      retry_counters[image_name] = retry_counters.get(image_name, 0) + 1
+      if retry_counters[image_name] >= 3:
+        # Postpone frame
+        writer.set_error(image_name, str(error))
+        retry_counters.pop(image_name, None)
+      else:
+        released.append(image_name)
+    # give failed frames back to the queue right away instead of waiting for the lease to expire
+    writer.release_frames(released, owner)
+
+    errors['count'] += 1
+    if errors['count'] > 10:
+      errors['count'] = 0
+      sqlite.set_service_status('failed')
+    try:
+      writer.log_error(error)
+    except Exception as e:
+      print(f"Error logging error: {e}")
+
+  scheduler = GridScheduler(config["PrivacyBacklogDrainSeconds"])
+
+  # decode -> infer -> post-process, each stage with its own pool and a bounded queue in between
+  pipeline = Pipeline([
+    Stage('decode', decode_stage, workers=config["PrivacyDecodeThreads"]),
+    Stage('infer', inference_stage, workers=config["PrivacyNumThreads"], init=init_inference),
+    Stage('postprocess', postprocess_stage, workers=config["PrivacyPostThreads"]),
+  ], on_complete=on_complete, on_error=on_error)
+
+  # new frames show up as framekms rows committed by the Node API, which move the ml_queue
+  # backlog counter. It's only read once data_version says another connection committed,
+  # and the logger's gnss / imu / frames writes leave it unchanged
+  last_seen = {'data_version': sqlite.get_data_version(), 'backlog': sqlite.get_ml_backlog()}
+  def backlog_changed():
+    version = sqlite.get_data_version()
+    if version == last_seen['data_version']:
+      return False
+    last_seen['data_version'] = version
+    backlog = sqlite.get_ml_backlog()
+    changed = backlog != last_seen['backlog']
+    last_seen['backlog'] = backlog
+    return changed
+  wakeup = Wakeup(check=backlog_changed)
+
+  def stop(signum, frame):
+    # systemctl stop / restart sends SIGTERM, leave through the finally below so
+    # the writer's queued results are committed and the leases are released
+    print('Watcher stopped by SIGTERM')
+    raise SystemExit(0)
+  signal.signal(signal.SIGTERM, stop)
+
+  # init watcher
+  try:
+    print('Starting watcher')
+    sqlite.set_service_status('healthy')
+
+    while True:
+      new_config = sqlite.poll_privacy_config(configured)
+      if new_config:
+        print('Privacy config updated', new_config)
+        configured = new_config
+        config.update(new_config)
+        config.update(tuned)
+        # updated in place, models loaded from now on pick up the new runtime options
+        backend_options.update(backend_class.options(config), **extra_options)
+        backend_options.update(tuned_options)
+        sqlite.detections_encoding = config["PrivacyDetectionsEncoding"]
+        sqlite.per_frame_metrics = config["PrivacyPerFrameMetrics"]
+        pipeline.resize('decode', config["PrivacyDecodeThreads"])
+        pipeline.resize('infer', config["PrivacyNumThreads"])
+        pipeline.resize('postprocess', config["PrivacyPostThreads"])
+        scheduler.drain_seconds = config["PrivacyBacklogDrainSeconds"]
+
+      # no-op once the queue exists, until then frames can't be claimed
+      sqlite.ensure_ml_queue()
+
+      if writer.pressure() > 0.5:
+        print('Result writer is falling behind', writer.stats())
+      summaries = stage_metrics.maybe_flush(writer)
+      if summaries:
+        print('Stage latencies', {stage: {k: round(v, 1) for k, v in summary.items()} for stage, summary in summaries.items()})
+        print('Pipeline', pipeline.stats())
+        now = int(time.time() * 1000)
+        writer.write_metrics(pipeline.metric_rows(now) + scheduler.metric_rows(now))
+
+      # keep up to PrivacyPrefetchFrames frames in flight, topped up in whole 2x2 groups,
+      # so the next frames are claimed and decoded while the current ones are still running
+      prefetch = max(config["PrivacyPrefetchFrames"], 4)
+      in_flight = pipeline.in_flight()
+      room = (prefetch - in_flight) // 4 * 4
+      images = []
+      claim_blocked = False
+      backing_off = time.monotonic() < progress['backoff_until']
+      if room > 0 and not backing_off:
+        try:
+          images, total = sqlite.claim_frames(owner, room)
+        except sqlite3.OperationalError as e:
+          # e.g. "database is locked" while the Node API vacuums or packs for longer than busy_timeout,
+          # nothing was claimed, try again in a bit
+          print(f"Claiming frames failed: {e}")
+          claim_blocked = True
+
+      if len(images) > 0:
+        print(f"Claimed {len(images)} frames, {total} pending")
+        if in_flight == 0:
+          # the pipeline was idle, the stuck check counts from the first submit, not from the last result
+          progress['last'] = time.monotonic()
+        if 2 in model_specs(config):
+          # 1x2 groups for low-speed frames, 2x2 for high-speed ones and for everything while a large backlog drains
+          groups = scheduler.plan(images, total, config["LowSpeedThreshold"], config["PrivacyNumThreads"])
+          if scheduler.draining:
+            print(f"Draining backlog of {total} frames with 2x2 groups")
+        else:
+          # no 2x2 model on this device, frames go in 1x2 pairs
+          groups = [images[i:i + 2] for i in range(0, len(images), 2)]
+        for group in groups:
+          print("pushing to 2x2" if len(group) > 2 else "pushing to 1x2")
+          # blocks while the decode queue is full
+          pipeline.submit({'images': group}, weight=len(group))
+
+      # nothing finished for a whole lease period while frames are in flight, the accelerator is likely stuck
+      if pipeline.in_flight() > 0 and time.monotonic() - progress['last'] > ML_LEASE_MS / 1000:
+        progress['last'] = time.monotonic()
+        progress['stuck_at'] = progress['completed']
+        sqlite.set_service_status('failed')
+      elif progress['stuck_at'] is not None and progress['completed'] > progress['stuck_at']:
+        # groups complete again
+        progress['stuck_at'] = None
+        sqlite.set_service_status('healthy')
+
+      if backing_off:
+        # a model failed to load, give the device a moment before claiming again
+        time.sleep(1)
+      elif room <= 0:
+        # window is full, claim again once half of it completed
+        pipeline.wait_below(prefetch // 2 + 1, timeout=1)
+      elif claim_blocked:
+        time.sleep(2)
+      elif len(images) == 0:
+        if in_flight == 0:
+          # caught up, sleep until the backlog changes rather than a fixed interval
+          wakeup.wait(3)
+        else:
+          # backlog is empty for now, check again when a group finishes
+          pipeline.wait_below(in_flight, timeout=1)
+      elif len(retry_counters) > 0:
+        # failed frames are released right away, don't spin on them
+        time.sleep(1)
+
+  except KeyboardInterrupt:
+    print('Watcher stopped by user')
+  except Exception as e:
+    print(f"An error occurred: {e}")
+    raise e
+  finally:
+    wakeup.close()
+    # groups past inference may already have replaced their frames with the blurred ones,
+    # give them a moment to hand their results to the writer
+    pipeline.wait_below(1, timeout=10)
+    stage_metrics.flush(writer)
+    writer.close()
+    sqlite.release_owner(owner)
+    sqlite.close()
+
+def file_hash(path):
+  # processed frames are marked with the hash of the model that ran on them
+  with open(path, 'rb') as f:
+    return hashlib.sha256(f.read()).hexdigest()
+
+if __name__ == '__main__':
+  # runs the detector with any backend, e.g. onnxruntime on a Linux box without the accelerator:
+  # python3 detector.py --backend onnx --db_path /tmp/data-logger.db --model_path n800_1x2.onnx
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--backend', type=str, choices=sorted(BACKENDS), default='onnx')
+  parser.add_argument('--db_path', type=str, required=True)
+  parser.add_argument('--ram_path', type=str, default='/tmp/recording/pic')
+  parser.add_argument('--model_path', type=str, required=True)
+  parser.add_argument('--grid_model_path', type=str, default=None)
+  parser.add_argument('--normalized_boxes', action='store_true')
+  args = parser.parse_args()
+
+  specs = {1: ModelSpec(args.model_path, file_hash(args.model_path), args.normalized_boxes)}
+  if args.grid_model_path:
+    specs[2] = ModelSpec(args.grid_model_path, file_hash(args.grid_model_path), args.normalized_boxes)
+  run_detector(args.db_path, args.ram_path, BACKENDS[args.backend], lambda config: specs)
@@ -1,8 +1,17 @@
 import cv2
+import io
 import time
 import os
 import numpy as np
 from typing import Tuple
+from PIL import Image
+
+# optional libjpeg-turbo binding, encodes straight from BGR
+try:
+  from turbojpeg import TurboJPEG
+  turbo_jpeg = TurboJPEG()
+except Exception:
+  turbo_jpeg = None
 
 def load(image_path, width, height, tensor_type, metrics):
   dtype = np.float32 if tensor_type == 'float32' else np.float16
@@ -26,6 +35,63 @@ def load(image_path, width, height, tensor_type, metrics):
   #returns tensor and reference on original image
   return tensor, img, metrics
 
+# JPEG scale factors libjpeg can decode to directly, largest first
+REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+def read_reduced(image_path, width, height, frame_width, frame_height):
+  # Decode at the smallest DCT scale that still covers width x height,
+  # so the IDCT skips most of the work a full-size decode + resize would do
+  for factor, flag in REDUCED_READ_FLAGS:
+    if frame_width // factor >= width and frame_height // factor >= height:
+      return cv2.imread(image_path, flag)
+  return cv2.imread(image_path)
+
+def encode_jpeg(img, quality=80, encoder='pil'):
+  # img is BGR. 'pil' is the original path (BGR->RGB copy + PIL encoder), 'cv2' and 'turbojpeg'
+  # encode from BGR directly; 'turbojpeg' falls back to 'cv2' when the binding isn't installed
+  if encoder == 'pil':
+    buffer = io.BytesIO()
+    Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+  if encoder == 'turbojpeg' and turbo_jpeg is not None:
+    return turbo_jpeg.encode(img, quality=quality)
+  ok, encoded = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+  if not ok:
+    raise ValueError('JPEG encoding failed')
+  return encoded
+
+def temp_path(path):
+  # hidden and without the .jpg extension, so frame listings never pick up a half-written file
+  directory, name = os.path.split(path)
+  return os.path.join(directory, '.' + os.path.splitext(name)[0] + '.part')
+
+def write_jpeg(img, path, quality=80, encoder='pil'):
+  # writes the encoded frame next to `path`, commit_files() moves it into place
+  tmp_path = temp_path(path)
+  with open(tmp_path, 'wb') as f:
+    f.write(encode_jpeg(img, quality, encoder))
+  return tmp_path, path
+
+def fsync_path(path):
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+def commit_files(files, fsync=False):
+  # files are (tmp_path, path) pairs. Renames are atomic, so readers and crashes see either the
+  # old or the new frame. With fsync the data is flushed before the renames and each directory
+  # once after them, batched over the whole group instead of one sync per file
+  if fsync:
+    for tmp_path, _ in files:
+      fsync_path(tmp_path)
+  for tmp_path, path in files:
+    os.replace(tmp_path, path)
+  if fsync:
+    for directory in set(os.path.dirname(path) for _, path in files):
+      fsync_path(directory)
+
 def letterbox(img: np.ndarray, new_shape:Tuple[int, int], color:Tuple[int, int, int] = (114, 114, 114), auto:bool = False, scale_fill:bool = False, scaleup:bool = False, stride:int = 32):
   shape = img.shape[:2]  # current shape [height, width]
   if isinstance(new_shape, int):
@@ -0,0 +1,48 @@
+import numpy as np
+from image import temp_path
+
+# Privacy blur in the JPEG compressed domain: only the 8x8 DCT blocks intersecting
+# detection boxes are touched, by dropping their AC coefficients (each block becomes
+# its flat average colour). Every other block is copied through bit-exact, so there is
+# no full decode / re-encode and no extra generation loss outside the boxes.
+# Needs the optional jpegio package; callers fall back to the pixel blur without it.
+try:
+  import jpegio
+except ImportError:
+  jpegio = None
+
+# 8x8 block mask keeping only the DC coefficient
+AC_PATTERN = np.ones((8, 8), dtype=bool)
+AC_PATTERN[0, 0] = False
+
+def available():
+  return jpegio is not None
+
+def block_mask(boxes, blocks_shape, block_h, block_w):
+  # blocks (in a component's block grid) touched by any box, boxes are x1, y1, x2, y2 pixels.
+  # block_h / block_w are the pixels one block covers vertically / horizontally
+  mask = np.zeros(blocks_shape, dtype=bool)
+  for x1, y1, x2, y2 in np.asarray(boxes).reshape(-1, 4):
+    bx1, by1 = int(x1 // block_w), int(y1 // block_h)
+    bx2, by2 = -int(-x2 // block_w), -int(-y2 // block_h)
+    mask[max(by1, 0):by2, max(bx1, 0):bx2] = True
+  return mask
+
+def blur_file(src_path, dst_path, boxes):
+  # writes the blurred frame next to dst_path, image.commit_files() moves it into place
+  jpeg = jpegio.read(src_path)
+  luma_shape = jpeg.coef_arrays[0].shape
+  for coefs in jpeg.coef_arrays:
+    # chroma planes are usually subsampled, so their blocks cover 16 pixels instead of 8,
+    # in both directions for 4:2:0, only horizontally for 4:2:2
+    block_h = 8 * luma_shape[0] // coefs.shape[0]
+    block_w = 8 * luma_shape[1] // coefs.shape[1]
+    blocks = block_mask(boxes, (coefs.shape[0] // 8, coefs.shape[1] // 8), block_h, block_w)
+    if not blocks.any():
+      continue
+    ac_mask = blocks.repeat(8, axis=0).repeat(8, axis=1) & np.tile(AC_PATTERN, blocks.shape)
+    coefs[ac_mask] = 0
+
+  tmp_path = temp_path(dst_path)
+  jpeg.write(tmp_path)
+  return tmp_path, dst_path
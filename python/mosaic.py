@@ -0,0 +1,57 @@
+import numpy as np
+
+# Helpers to map detections on a mosaic (several frames combined into one model input)
+# back onto the source frames. Everything works on (N, 4) x1, y1, x2, y2 arrays,
+# so the cost doesn't grow with a Python loop per box.
+
+def grid_layout(model_size, grid_size):
+    # (columns, rows, cell_width, cell_height) of the detector mosaics:
+    # grid_size 1 stacks two frames on top of each other (1x2), grid_size 2 is a 2x2 grid
+    if grid_size == 1:
+        return 1, 2, model_size, model_size // 2
+    return 2, 2, model_size // 2, model_size // 2
+
+def unmosaic(boxes, columns, rows, cell_width, cell_height, frame_width, frame_height, scale=None):
+    # Returns the cell index of every box and the boxes in source frame pixels, floored and clipped.
+    # The cell is picked by the top-left corner, clamped to the grid for boxes poking out of it.
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x_index = np.clip(boxes[:, 0] // cell_width, 0, columns - 1).astype(int)
+    y_index = np.clip(boxes[:, 1] // cell_height, 0, rows - 1).astype(int)
+
+    if scale is None:
+        scale = (frame_width / cell_width, frame_height / cell_height)
+    x_offset = (x_index * cell_width)[:, np.newaxis]
+    y_offset = (y_index * cell_height)[:, np.newaxis]
+
+    frame_boxes = np.empty_like(boxes)
+    frame_boxes[:, ::2] = (boxes[:, ::2] - x_offset) * scale[0]
+    frame_boxes[:, 1::2] = (boxes[:, 1::2] - y_offset) * scale[1]
+    frame_boxes = np.floor(frame_boxes)
+    np.clip(frame_boxes, 0, (frame_width, frame_height, frame_width, frame_height), out=frame_boxes)
+
+    return y_index * columns + x_index, frame_boxes.astype(int)
+
+def filter_boxes(boxes, scores, conf_threshold, frame_width, frame_height):
+    # Keep-mask for frame boxes: drops wide boxes on the hood, and large boxes
+    # (1/6 of the frame or bigger) unless the prediction is extra-confident
+    box_width = boxes[:, 2] - boxes[:, 0]
+    box_area = box_width * (boxes[:, 3] - boxes[:, 1])
+    on_hood = (box_width > 0.8 * frame_width) & (boxes[:, 1] > 0.5 * frame_height)
+    too_large = (box_area > frame_width * frame_height / 6) & (np.asarray(scores) < conf_threshold + 0.2)
+    return ~(on_hood | too_large)
+
+def rotate_boxes(boxes, frame_width, frame_height):
+    # Same boxes on a frame rotated by 180 degrees
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    return np.stack([
+        frame_width - boxes[:, 2],
+        frame_height - boxes[:, 3],
+        frame_width - boxes[:, 0],
+        frame_height - boxes[:, 1],
+    ], axis=1)
+
+def group_by_cell(cell_index, total_cells):
+    # Box indices per cell, in their original order
+    order = np.argsort(cell_index, kind='stable')
+    counts = np.bincount(cell_index, minlength=total_cells)[:total_cells]
+    return np.split(order, np.cumsum(counts)[:-1])
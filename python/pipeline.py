@@ -0,0 +1,180 @@
+import numpy as np
+import queue
+import threading
+import time
+
+# A stage of the detector pipeline: `workers` threads pulling jobs from a bounded queue,
+# running fn(job, context) and handing the result to the next stage. `init` builds a
+# per-thread context (e.g. the thread's own interpreter), so non thread-safe resources
+# never cross threads. fn returning None drops the job (it's considered done)
+class Stage:
+    def __init__(self, name, fn, workers=1, queue_size=None, init=None):
+        self.name = name
+        self.fn = fn
+        self.init = init
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size or max(2, 2 * workers))
+        self.threads = {}
+        self._lock = threading.Lock()
+        self._busy = 0.0
+        self._processed = 0
+        self._window_start = time.monotonic()
+
+    def record(self, busy):
+        with self._lock:
+            self._busy += busy
+            self._processed += 1
+
+    def stats(self, reset=False):
+        with self._lock:
+            elapsed = max(time.monotonic() - self._window_start, 1e-6)
+            stats = {
+                'workers': self.workers,
+                'queue': self.queue.qsize(),
+                'processed': self._processed,
+                # share of the stage's thread time spent working, 1.0 means saturated
+                'utilization': min(self._busy / (elapsed * max(self.workers, 1)), 1.0),
+            }
+            if reset:
+                self._busy = 0.0
+                self._processed = 0
+                self._window_start = time.monotonic()
+            return stats
+
+# Runs jobs through a chain of stages connected by bounded queues, e.g.
+# decode -> infer -> postprocess, so each stage can be sized independently and the
+# accelerator always has the next tensor waiting. submit() blocks once the first
+# queue is full; join() waits until every submitted job completed or failed.
+# Jobs carry a weight (e.g. their frame count), in_flight() is the sum over unfinished jobs
+class Pipeline:
+    def __init__(self, stages, on_complete=None, on_error=None):
+        self.stages = stages
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self._in_flight = 0
+        self._weights = {}
+        self._in_flight_cond = threading.Condition()
+        for index in range(len(stages)):
+            self._start_workers(index)
+
+    def submit(self, job, weight=1):
+        with self._in_flight_cond:
+            self._in_flight += weight
+            self._weights[id(job)] = weight
+        self.stages[0].queue.put(job)
+
+    def in_flight(self):
+        with self._in_flight_cond:
+            return self._in_flight
+
+    def wait_below(self, limit, timeout=None):
+        # blocks until less than `limit` is in flight, returns False on timeout
+        with self._in_flight_cond:
+            return self._in_flight_cond.wait_for(lambda: self._in_flight < limit, timeout)
+
+    def resize(self, name, workers):
+        # more workers start right away; surplus ones exit after their current job
+        for index, stage in enumerate(self.stages):
+            if stage.name == name and stage.workers != workers:
+                print(f"Resizing {name} stage: {stage.workers} -> {workers} workers")
+                stage.workers = workers
+                self._start_workers(index)
+
+    def stats(self, reset=False):
+        return {stage.name: stage.stats(reset) for stage in self.stages}
+
+    def metric_rows(self, started):
+        # (operation, key, started, duration) rows for the metrics table, utilization in percent
+        rows = []
+        for name, stats in self.stats(reset=True).items():
+            rows.append(('ml_stage_' + name, 'utilization', started, int(stats['utilization'] * 100)))
+            rows.append(('ml_stage_' + name, 'queue', started, stats['queue']))
+            rows.append(('ml_stage_' + name, 'workers', started, stats['workers']))
+        return rows
+
+    def _start_workers(self, index):
+        stage = self.stages[index]
+        for worker_index in range(stage.workers):
+            thread = stage.threads.get(worker_index)
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=self._run, args=(index, worker_index), name=f'{stage.name}-{worker_index}', daemon=True)
+                stage.threads[worker_index] = thread
+                thread.start()
+
+    def _done(self, job, error=None, stage=None):
+        try:
+            if error is not None:
+                if self.on_error:
+                    self.on_error(job, error, stage)
+            elif self.on_complete:
+                self.on_complete(job)
+        except Exception as e:
+            print(f"Error finishing job: {e}")
+        with self._in_flight_cond:
+            self._in_flight -= self._weights.pop(id(job), 1)
+            self._in_flight_cond.notify_all()
+
+    def _run(self, index, worker_index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        context = {}
+        # e.g. the accelerator isn't ready yet at boot, keep retrying rather than
+        # leaving the stage without workers and its queue filling up for good
+        backoff = 1
+        while stage.init:
+            try:
+                context = stage.init()
+                break
+            except Exception as e:
+                print(f"Error initializing {stage.name} worker {worker_index}, retrying in {backoff}s: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+            if worker_index >= stage.workers:
+                stage.threads.pop(worker_index, None)
+                return
+
+        while True:
+            job = stage.queue.get()
+            start = time.perf_counter()
+            try:
+                result = stage.fn(job, context)
+                stage.record(time.perf_counter() - start)
+                if result is None:
+                    self._done(job)
+                elif next_stage:
+                    next_stage.queue.put(result)
+                else:
+                    self._done(result)
+            except Exception as e:
+                stage.record(time.perf_counter() - start)
+                self._done(job, e, stage.name)
+            stage.queue.task_done()
+
+            # the stage was resized down
+            if worker_index >= stage.workers:
+                print(f"Stopping {stage.name} worker {worker_index}")
+                stage.threads.pop(worker_index, None)
+                return
+
+# Reusable numpy buffers keyed by shape and dtype. A job takes one in an early stage
+# and a later stage hands it back, so in steady state no tensors are allocated.
+# The number of buffers is bounded by the jobs in flight, which the stage queues bound
+class BufferPool:
+    def __init__(self):
+        self._free = {}
+        self._lock = threading.Lock()
+        self.allocated = 0
+
+    def acquire(self, shape, dtype):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+            self.allocated += 1
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, buffer):
+        key = (buffer.shape, buffer.dtype.str)
+        with self._lock:
+            self._free.setdefault(key, []).append(buffer)
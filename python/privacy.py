@@ -8,6 +8,8 @@ import threading
 import shutil
 import time
 from yolov8.utils import nms, xywh2xyxy
+from mosaic import unmosaic, group_by_cell
+from wakeup import Wakeup
 from damoyolo.damoyolo_onnx import DAMOYOLO
 from PIL import Image 
 import psutil
@@ -41,6 +43,8 @@ detections = 0
 
 def readImage(f, w, h): 
     with Image.open(f) as im:
+        # let the JPEG decoder scale down by 1/2, 1/4 or 1/8 before the resize
+        im.draft('RGB', (w, h))
         arr = np.asarray(im.resize((w, h), Image.NEAREST))
     return arr
 
@@ -72,23 +76,6 @@ def combine_images(images, folder_path, grid_size):
 
   return img
 
-def transform_box(box, w_offset=0, h_offset=0, width=None, height=None, multiplier=2):
-  # Apply transformations: scale, offset, round
-  new_box = np.floor(np.array([
-    (box[0] - w_offset) * multiplier,
-    (box[1] - h_offset) * multiplier,
-    (box[2] - w_offset) * multiplier,
-    (box[3] - h_offset) * multiplier
-  ])).astype(int)
-  
-  # Making sure all the box coordinates are within the boundaries
-  if width is not None:
-    new_box[::2] = np.clip(new_box[::2], 0, width)  # for x-coordinates
-  if height is not None:
-    new_box[1::2] = np.clip(new_box[1::2], 0, height)  # for y-coordinates
-  
-  return new_box
-
 # 2x2, 3x3, 4x4
 def determine_grid_dimension(num_images):
   if num_images <= 30:
@@ -115,11 +102,6 @@ def extract_unix_timestamp_from_folder(folder_name):
     print(f"Error extracting timestamp from folder name {folder_name}: {e}")
     return None
 
-def determine_image_index(box, w, h, grid_size):
-  x_index = int(box[0] // w)
-  y_index = int(box[1] // h)
-  return y_index * grid_size + x_index
-
 def detect(folder_path, images, session_sm, session_md, conf_threshold, nms_threshold, grid_size):
   global total_samples, blurred_samples, inference_time, combine_time, save_time
 
@@ -156,20 +138,12 @@ def detect(folder_path, images, session_sm, session_md, conf_threshold, nms_thre
   if len(scores) == 0:
       return res_output
 
-  grouped_boxes = [[] for _ in range(grid_size*grid_size)]
-  offsets = [(i * w2, j * h2) for j in range(grid_size) for i in range(grid_size)]
-
   # Split boxes between initial images
-  for box, score, class_id in zip(boxes, scores, class_ids):
-      image_index = determine_image_index(box, w2, h2, grid_size)
-
-      w_offset, h_offset = offsets[image_index]
-      box = transform_box(box, w_offset, h_offset, width, height, grid_size)
+  cell_index, frame_boxes = unmosaic(boxes, grid_size, grid_size, w2, h2, width, height, scale=(grid_size, grid_size))
+  groups = group_by_cell(cell_index, grid_size*grid_size)
+  grouped_boxes = [frame_boxes[indices] for indices in groups]
+  res_output = [[[CLASS_NAMES[class_ids[j]]] + frame_boxes[j].tolist() + [scores[j]] for j in indices] for indices in groups]
 
-      grouped_boxes[image_index].append(box)
-      res_output[image_index].append([CLASS_NAMES[class_id]] + list(box) + [score])
-
-     
   # apply blur
   for i, image_name in enumerate(images):
     if len(grouped_boxes[i]) > 0:
@@ -224,6 +198,16 @@ def blur(img, boxes):
 
   return result
 
+# seconds a folder has to stay unchanged before it's processed
+FOLDER_SETTLE_SECONDS = 2
+
+def folder_mtime(path):
+  # gone folders count as just changed, they drop out of the listing on the next pass
+  try:
+    return os.stat(path).st_mtime
+  except OSError:
+    return time.time()
+
 def main(input_path, output_path, model_path, conf_threshold, nms_threshold, num_threads, grid_dimension):
   global detections
   if not os.path.exists(model_path):
@@ -306,12 +290,19 @@ def main(input_path, output_path, model_path, conf_threshold, nms_threshold, num
     if not os.path.exists(input_path):
       os.makedirs(input_path)
 
+    # wakes up as soon as a folder is created or moved in, listing every 2s is only the fallback.
+    # Folders still being filled are left for a later pass, see FOLDER_SETTLE_SECONDS
+    wakeup = Wakeup([input_path])
+
     # tracemalloc.start()
     # snapshot1 = tracemalloc.take_snapshot()
 
     while True:
       current_folders = {f for f in os.listdir(input_path) if f.startswith('km_')}
-      new_folders = sorted(current_folders - seen_folders)
+      # a folder is only picked up once nothing was added to it for a while, the wakeup
+      # fires on its mkdir while its frames may still be arriving
+      now = time.time()
+      new_folders = [f for f in sorted(current_folders - seen_folders) if now - folder_mtime(os.path.join(input_path, f)) >= FOLDER_SETTLE_SECONDS]
 
       if not in_process:  # Only process if not currently in process
           for folder in new_folders:
@@ -507,7 +498,7 @@ def main(input_path, output_path, model_path, conf_threshold, nms_threshold, num
               in_process = False  # Reset the flag once processing is done
 
       seen_folders.update(new_folders)
-      time.sleep(2)
+      wakeup.wait(2)
   except KeyboardInterrupt:
       print('Watcher stopped by user')
   except Exception as e:
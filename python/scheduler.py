@@ -0,0 +1,73 @@
+import threading
+
+FRAMES_PER_GRID = {1: 2, 2: 4}
+LAYOUT_NAMES = {1: '1x2', 2: '2x2'}
+
+# Picks the mosaic layout for every claimed batch. Low-speed frames normally go through
+# the 1x2 model (two frames per inference, more pixels per frame), high-speed frames
+# through the 2x2 one (four per inference). When the backlog would take longer than
+# `drain_seconds` to clear at the measured 1x2 rate, and 2x2 is actually faster per frame,
+# low-speed frames go to 2x2 as well until the backlog is down to half of that target.
+# The hysteresis keeps the layout from flapping between watcher loops.
+class GridScheduler:
+    def __init__(self, drain_seconds=120, alpha=0.2):
+        self.drain_seconds = drain_seconds
+        # smoothing of the per-inference latency averages
+        self.alpha = alpha
+        self.latency_ms = {1: None, 2: None}
+        self.draining = False
+        self.backlog = 0
+        self.drain_estimate = None
+        self.groups = {1: 0, 2: 0}
+        self.lock = threading.Lock()
+
+    def record(self, grid_size, inference_ms):
+        with self.lock:
+            latency = self.latency_ms[grid_size]
+            self.latency_ms[grid_size] = inference_ms if latency is None else latency + self.alpha * (inference_ms - latency)
+
+    def frames_per_second(self, grid_size, workers=1):
+        latency = self.latency_ms[grid_size]
+        if not latency:
+            return None
+        return FRAMES_PER_GRID[grid_size] * workers * 1000 / latency
+
+    def plan(self, images, backlog, low_speed_threshold, workers=1):
+        # returns the groups to submit, 2 frames per group for 1x2, 4 for 2x2
+        with self.lock:
+            self.backlog = backlog
+            rate = self.frames_per_second(1, workers)
+            grid_rate = self.frames_per_second(2, workers)
+            self.drain_estimate = backlog / rate if rate else None
+            # an unmeasured 2x2 model gets a chance, it's the only way to learn its rate
+            grid_is_faster = grid_rate is None or rate is None or grid_rate > rate
+            if self.drain_estimate is not None and self.drain_estimate > self.drain_seconds and grid_is_faster:
+                self.draining = True
+            elif self.drain_estimate is None or self.drain_estimate < self.drain_seconds / 2 or not grid_is_faster:
+                self.draining = False
+
+            low_speed_images = [] if self.draining else [img for img in images if img[2] <= low_speed_threshold]
+            high_speed_images = images if self.draining else [img for img in images if img[2] > low_speed_threshold]
+            groups = [low_speed_images[i:i + 2] for i in range(0, len(low_speed_images), 2)]
+            groups += [high_speed_images[i:i + 4] for i in range(0, len(high_speed_images), 4)]
+            for group in groups:
+                # detect_hdc picks the layout from the group size
+                self.groups[2 if len(group) > 2 else 1] += 1
+            return groups
+
+    def metric_rows(self, started):
+        # (operation, key, started, duration) rows for the metrics table, group counts since the last call
+        with self.lock:
+            rows = [
+                ('ml_scheduler', 'draining', started, int(self.draining)),
+                ('ml_scheduler', 'backlog', started, self.backlog),
+            ]
+            for grid_size, groups in self.groups.items():
+                rows.append(('ml_scheduler', 'groups_' + LAYOUT_NAMES[grid_size], started, groups))
+            if self.drain_estimate is not None:
+                rows.append(('ml_scheduler', 'drain_seconds', started, int(self.drain_estimate)))
+            for grid_size, latency in self.latency_ms.items():
+                if latency is not None:
+                    rows.append(('ml_scheduler', 'latency_' + LAYOUT_NAMES[grid_size], started, int(latency)))
+            self.groups = {1: 0, 2: 0}
+            return rows
@@ -1,15 +1,264 @@
 import sqlite3
 import json
+import struct
+import threading
+import time
 from datetime import datetime
 from decimal import Decimal
 
+# Applied to every pooled connection. synchronous=NORMAL is safe in WAL mode
+# (a power loss can only roll back the last transactions, not corrupt the db).
+# 8 MiB page cache instead of the 2 MiB default keeps the framekms pages and the
+# ml pending index hot between claims; there's only a few connections per process
+CONNECTION_PRAGMAS = [
+    'PRAGMA busy_timeout=5000;',
+    'PRAGMA synchronous=NORMAL;',
+    'PRAGMA cache_size=-8192;',
+    'PRAGMA mmap_size=67108864;',
+    'PRAGMA temp_store=MEMORY;',
+]
+
+# A frame is waiting for the detector while it has no result, no error and its framekm is not postponed
+ML_PENDING = 'ml_model_hash IS NULL AND (error IS NULL OR error = \'\') AND postponed != 1'
+
+def ml_pending(row):
+    return f"IFNULL({row}.ml_model_hash IS NULL AND ({row}.error IS NULL OR {row}.error = '') AND {row}.postponed != 1, 0)"
+
+# Pending frames that are not leased by a detector worker, or whose lease ran out
+ML_CLAIMABLE = f'{ML_PENDING} AND (ml_claimed_at IS NULL OR ml_claimed_at < ?)'
+
+# Read-only probe, answered from the framekms_ml_pending index without taking the write lock
+HAS_CLAIMABLE_QUERY = f'SELECT 1 FROM framekms WHERE {ML_CLAIMABLE} LIMIT 1'
+
+# Claimable frames of the oldest framekm with claimable work, together with the maintained
+# backlog size. Both framekms lookups are served by the framekms_ml_pending index
+CLAIM_FRAMES_QUERY = f'''
+    SELECT image_name, image_path, speed, fkm_id, orientation, (
+        SELECT value FROM ml_queue WHERE key = 'pending'
+    ) AS total
+    FROM framekms
+    WHERE {ML_CLAIMABLE} AND fkm_id = (
+        SELECT fkm_id
+        FROM framekms
+        WHERE {ML_CLAIMABLE}
+        ORDER BY time
+        LIMIT 1
+    )
+    ORDER BY time
+    LIMIT ?
+'''
+
+# Default time a claimed frame stays reserved for its worker. Has to comfortably
+# exceed the time needed to process one group; expired claims are picked up again
+ML_LEASE_MS = 60 * 1000
+
+# Lease columns. The Node API adds them to both framekm tables in its soft migrations,
+# in pairs, since packed_framekms is filled with SELECT * FROM framekms
+ML_LEASE_COLUMNS = ['ml_claimed_by', 'ml_claimed_at']
+
+ML_QUEUE_SCHEMA = [
+    # Partial covering index: only pending frames are indexed, so polling for work
+    # does not depend on how many processed frames are kept in framekms.
+    # The predicate columns are included so the planner never has to visit the table
+    f'''CREATE INDEX IF NOT EXISTS framekms_ml_pending
+       ON framekms (time, fkm_id, image_name, image_path, speed, orientation, ml_model_hash, error, postponed, ml_claimed_at)
+       WHERE {ML_PENDING};''',
+    # Backlog size, maintained by triggers instead of COUNT(*) on every poll
+    '''CREATE TABLE IF NOT EXISTS ml_queue (
+       key TEXT PRIMARY KEY NOT NULL,
+       value INTEGER NOT NULL
+       );''',
+    f'''CREATE TRIGGER IF NOT EXISTS framekms_ml_pending_insert
+       AFTER INSERT ON framekms WHEN {ml_pending('NEW')}
+       BEGIN
+         UPDATE ml_queue SET value = value + 1 WHERE key = 'pending';
+       END;''',
+    f'''CREATE TRIGGER IF NOT EXISTS framekms_ml_pending_delete
+       AFTER DELETE ON framekms WHEN {ml_pending('OLD')}
+       BEGIN
+         UPDATE ml_queue SET value = value - 1 WHERE key = 'pending';
+       END;''',
+    f'''CREATE TRIGGER IF NOT EXISTS framekms_ml_pending_update
+       AFTER UPDATE OF ml_model_hash, error, postponed ON framekms WHEN {ml_pending('NEW')} != {ml_pending('OLD')}
+       BEGIN
+         UPDATE ml_queue SET value = value + {ml_pending('NEW')} - {ml_pending('OLD')} WHERE key = 'pending';
+       END;''',
+]
+
+def error_log_time():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S.00000")
+
+# Coalesces error_logs writes during failure storms. Within each window the first
+# occurrence of up to max_messages distinct messages is written right away; repeats only
+# bump a counter and are written as one summary row when the window closes, so any number
+# of failures costs at most 2 * max_messages + 1 rows per window
+class ErrorSink:
+    def __init__(self, window=60, max_messages=10):
+        self.window = window
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._start_window(time.monotonic())
+
+    def _start_window(self, now):
+        self._window_start = now
+        self._counts = {}
+        self._suppressed = 0
+
+    def add(self, error):
+        # returns the (message, system_time) rows to write now, usually none
+        message = str(error)
+        with self._lock:
+            rows = self._collect(time.monotonic())
+            if message in self._counts:
+                self._counts[message] += 1
+            elif len(self._counts) < self.max_messages:
+                self._counts[message] = 1
+                rows.append((message, error_log_time()))
+            else:
+                self._suppressed += 1
+            return rows
+
+    def collect(self, force=False):
+        # summary rows of the finished window (or of the current one if forced)
+        with self._lock:
+            return self._collect(time.monotonic(), force)
+
+    def _collect(self, now, force=False):
+        if not force and now - self._window_start < self.window:
+            return []
+        elapsed = int(now - self._window_start)
+        rows = [(f"{message} (repeated {count - 1} more times in {elapsed}s)", error_log_time()) for message, count in self._counts.items() if count > 1]
+        if self._suppressed:
+            rows.append((f"{self._suppressed} more errors suppressed in {elapsed}s", error_log_time()))
+        self._start_window(now)
+        return rows
+
+PRIVACY_CONFIG_DEFAULTS = {
+    'PrivacyModelPath': '/opt/dashcam/bin/n800_1x2_float16.tflite',
+    'PrivacyModelHash': 'aed96116f29ed50e6844e5a5861c3d2316a6d2fb7a00afc4d248da8702d4e434',
+    'PrivacyModelGridPath': '/opt/dashcam/bin/n800_2x2_float16.tflite',
+    'PrivacyModelGridHash': 'e2f5488db4aa6bb0b1dba82476a238ca899c804cbee580f398051d62b7874702',
+    'LowSpeedThreshold': 17,
+    # detect_hdc sends low-speed frames to 2x2 too while the backlog would take longer than this to clear
+    'PrivacyBacklogDrainSeconds': 120,
+    'PrivacyConfThreshold': 0.2,
+    'PrivacyNmsThreshold': 0.9,
+    # inference workers
+    'PrivacyNumThreads': 4,
+    # TFLite threads per inference worker (0 leaves it to the runtime) and its XNNPACK delegate
+    'PrivacyTfliteThreads': 0,
+    'PrivacyTfliteXnnpack': True,
+    # benchmark inference workers x runtime threads on startup, the fastest combination
+    # overrides PrivacyNumThreads and PrivacyTfliteThreads (CPU backends only)
+    'PrivacyAutotune': False,
+    # frame decode / post-process (blur, encode, persist) workers
+    'PrivacyDecodeThreads': 2,
+    'PrivacyPostThreads': 2,
+    # frames kept claimed and in flight in the detector pipeline
+    'PrivacyPrefetchFrames': 48,
+    # 'json' or 'packed', see encode_detections
+    'PrivacyDetectionsEncoding': 'json',
+    # 'pixel' decodes, blurs and re-encodes the frame, 'dct' only rewrites the JPEG blocks under the boxes
+    'PrivacyBlurMode': 'pixel',
+    # 'pil', 'cv2' or 'turbojpeg' encoder for blurred frames, see image.encode_jpeg
+    'PrivacyJpegEncoder': 'pil',
+    # fsync blurred frames (batched per group) before their results are written
+    'PrivacyFsync': False,
+    # write the ml_*_time columns for every frame
+    'PrivacyPerFrameMetrics': True
+}
+
+# Model paths written to the config table by the Node API defaults (see ML_MODEL_PATH in src/config)
+IGNORED_MODEL_PATHS = [
+    '/opt/dashcam/bin/n640_float16.tflite',
+    '/opt/object-detection/model.blob',
+]
+
+# Compact ml_detections encoding: b'DET' + version byte + uint16 count, then per detection
+# four int16 box coordinates, a uint8 class id and a float16 score, all little-endian.
+# 11 bytes per detection instead of ~60 bytes of JSON text
+DETECTIONS_MAGIC = b'DET'
+DETECTIONS_VERSION = 1
+DETECTIONS_HEADER = struct.Struct('<3sBH')
+DETECTION = struct.Struct('<4hBe')
+
+def encode_detections(detections, encoding='json'):
+    if encoding != 'packed':
+        return json.dumps(detections)
+    packed = [DETECTIONS_HEADER.pack(DETECTIONS_MAGIC, DETECTIONS_VERSION, len(detections))]
+    for box, score, class_id in detections:
+        packed.append(DETECTION.pack(*(int(v) for v in box), int(class_id), float(score)))
+    return b''.join(packed)
+
+def decode_detections(value):
+    # reads both encodings, rows written before the packed format stay readable
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return json.loads(value)
+    value = bytes(value)
+    magic, version, count = DETECTIONS_HEADER.unpack_from(value)
+    if magic != DETECTIONS_MAGIC or version != DETECTIONS_VERSION:
+        raise ValueError(f'Unsupported detections encoding: {magic} v{version}')
+    detections = []
+    for i in range(count):
+        x_min, y_min, x_max, y_max, class_id, score = DETECTION.unpack_from(value, DETECTIONS_HEADER.size + i * DETECTION.size)
+        detections.append(([x_min, y_min, x_max, y_max], score, class_id))
+    return detections
+
+# Without per-frame timings only the result itself is stored; stage latencies are then
+# only available as the aggregated summaries in the metrics table (see stage_metrics.py)
+SET_FRAME_ML_RESULT_QUERY = 'UPDATE framekms SET ml_model_hash=?, ml_detections=?, ml_processed_at=?, ml_grid=? WHERE image_name=?'
+
+SET_FRAME_ML_QUERY = 'UPDATE framekms SET ml_model_hash=?, ml_detections=?, ml_processed_at=?, ml_inference_time=?, ml_read_time=?, ml_blur_time=?, ml_write_time=?, ml_downscale_time=?, ml_upscale_time=?, ml_mask_time=?, ml_composite_time=?, ml_load_time=?, ml_transpose_time=?, ml_letterbox_time=?, ml_grid=? WHERE image_name=?'
+
 class SQLite:
     def __init__(self, db_name):
         self.db_name = db_name
+        # one persistent connection per thread, all tracked so close() can release them
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._generation = 0
+        self.detections_encoding = 'json'
+        self.per_frame_metrics = True
+        self.error_sink = ErrorSink()
+        # set once the ml_queue schema exists, until then nothing can be claimed
+        self.ml_queue_ready = False
+        self._ml_queue_error = None
         self.ensure_wal_mode()
+        self.ensure_ml_queue()
 
     def get_connection(self):
-        return sqlite3.connect(self.db_name)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.generation != self._generation:
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.generation = self._generation
+        return conn
+
+    def _connect(self):
+        # check_same_thread is off only so close() can release connections owned by
+        # other threads; each connection is otherwise used by its own thread
+        conn = sqlite3.connect(self.db_name, timeout=5, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def close(self):
+        # closes every pooled connection. Threads still using this instance
+        # transparently reconnect on their next call
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+            self._generation += 1
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                print(f"Error closing connection: {e}")
 
     def ensure_wal_mode(self):
         with self.get_connection() as conn:
@@ -20,79 +269,165 @@ class SQLite:
             else:
                 print("Database already in WAL mode.")
 
-    def get_frames_for_ml(self, limit=10):
+    def ensure_ml_queue(self):
+        # Returns whether the ml_queue schema is ready. The detector retries it from
+        # its watcher, e.g. while the Node API hasn't migrated framekms yet
+        if self.ml_queue_ready:
+            return True
+        try:
+            with self.get_connection() as conn:
+                # checked before taking the write lock, retries are cheap this way
+                columns = [row[1] for row in conn.execute('PRAGMA table_info(framekms);')]
+                missing = [column for column in ML_LEASE_COLUMNS if column not in columns]
+                if missing:
+                    # the framekm tables belong to the Node API, never alter them from here
+                    raise RuntimeError(f"framekms has no {', '.join(missing)} column yet, waiting for the Node API migrations")
+                # schema and counter reconciliation happen atomically, so no framekms
+                # write can slip in between creating the triggers and counting
+                conn.execute('BEGIN IMMEDIATE;')
+                for statement in ML_QUEUE_SCHEMA:
+                    conn.execute(statement)
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO ml_queue (key, value)
+                    VALUES ('pending', (SELECT COUNT(*) FROM framekms WHERE {ML_PENDING}))
+                ''')
+            self.ml_queue_ready = True
+            self._ml_queue_error = None
+            self.verify_ml_queue()
+        except Exception as e:
+            # logged once per distinct error, the watcher retries every few seconds
+            if str(e) != self._ml_queue_error:
+                print(f"Error preparing ML queue index: {e}")
+                self._ml_queue_error = str(e)
+        return self.ml_queue_ready
+
+    def verify_ml_queue(self):
+        # every framekms lookup of the claim queries has to be served by the partial index
+        now = int(datetime.utcnow().timestamp() * 1000)
+        queries = {
+            'claim': (CLAIM_FRAMES_QUERY, (now, now, 1)),
+            'probe': (HAS_CLAIMABLE_QUERY, (now,)),
+        }
+        with self.get_connection() as conn:
+            unindexed = {}
+            for name, (query, params) in queries.items():
+                plan = [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()]
+                if any('framekms' in step and 'framekms_ml_pending' not in step for step in plan):
+                    unindexed[name] = plan
+            if unindexed:
+                print("WARNING: ML queue index is not used by the claim queries:", unindexed)
+                return False
+            print("ML queue index in use.")
+            return True
+
+    def get_ml_backlog(self):
+        if not self.ml_queue_ready:
+            return 0
+        with self.get_connection() as conn:
+            row = conn.execute("SELECT value FROM ml_queue WHERE key = 'pending'").fetchone()
+            return row[0] if row else 0
+
+    def get_data_version(self):
+        # changes whenever another connection (e.g. the Node API) commits to the db
+        return self.get_connection().execute('PRAGMA data_version;').fetchone()[0]
+
+    def is_ml_enabled(self):
+        # config flags are only re-read when the db was changed by another connection.
+        # data_version is per connection, so the cache lives next to the thread's connection
+        data_version = self.get_data_version()
+        cached = getattr(self._local, 'ml_enabled', None)
+        if cached is not None and cached[0] == data_version and self._local.ml_enabled_generation == self._generation:
+            return cached[1]
+
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT value FROM config WHERE key = "isDashcamMLEnabled"')
-            is_enabled = cursor.fetchone()
-            if is_enabled and len(is_enabled) and is_enabled[0] == 'false':
-                return [], 0
-            
-            cursor.execute('SELECT value FROM config WHERE key = "isProcessingEnabled"')
-            is_enabled = cursor.fetchone()
-            if is_enabled and len(is_enabled) and is_enabled[0] == 'false':
-                return [], 0
-            
-            cursor.execute('SELECT fkm_id FROM framekms WHERE ml_model_hash is NULL AND (error is NULL OR error = "")  AND postponed != 1 ORDER BY time LIMIT 1')
-            min_framekm_id_result = cursor.fetchone()
-            if min_framekm_id_result is None:
+            cursor.execute('SELECT key, value FROM config WHERE key IN ("isDashcamMLEnabled", "isProcessingEnabled")')
+            is_enabled = all(value != 'false' for key, value in cursor.fetchall())
+
+        self._local.ml_enabled = (data_version, is_enabled)
+        self._local.ml_enabled_generation = self._generation
+        return is_enabled
+
+    def claim_frames(self, owner, limit=10, lease_ms=ML_LEASE_MS):
+        # Atomically leases up to `limit` frames of the oldest framekm with unclaimed work.
+        # BEGIN IMMEDIATE takes the write lock before selecting, so concurrent workers,
+        # in this or any other process, can never claim the same frame
+        if not self.ml_queue_ready or not self.is_ml_enabled():
+            return [], 0
+
+        now = int(datetime.utcnow().timestamp() * 1000)
+        with self.get_connection() as conn:
+            # most polls find nothing, don't compete with the Node API for the write lock then
+            if conn.execute(HAS_CLAIMABLE_QUERY, (now - lease_ms,)).fetchone() is None:
                 return [], 0
-            
-            min_framekm_id = min_framekm_id_result[0]
-            if min_framekm_id is None:
+            conn.execute('BEGIN IMMEDIATE;')
+            rows = conn.execute(CLAIM_FRAMES_QUERY, (now - lease_ms, now - lease_ms, limit)).fetchall()
+            if not rows:
                 return [], 0
 
-            cursor.execute('''
-                SELECT image_name, image_path, speed, fkm_id, orientation 
-                FROM framekms 
-                WHERE ml_model_hash is NULL AND (error is NULL OR error = "") AND fkm_id = ? 
-                ORDER BY time 
-                LIMIT ?
-            ''', (min_framekm_id, limit))
-            
-            images = cursor.fetchall()
-
-            cursor.execute('''
-                SELECT COUNT(*) 
-                FROM framekms 
-                WHERE ml_model_hash is NULL AND (error is NULL OR error = "")
-            ''')
-            total = cursor.fetchall()
-
-            return images, total[0][0]
-        
+            conn.executemany('UPDATE framekms SET ml_claimed_by=?, ml_claimed_at=? WHERE image_name=?', [(owner, now, row[0]) for row in rows])
+            images = [row[:5] for row in rows]
+            return images, rows[0][5]
+
+    def release_frames(self, image_names, owner):
+        # hands frames back to the queue, e.g. after a failed attempt, without waiting for the lease to expire
+        if not image_names:
+            return
+        with self.get_connection() as conn:
+            conn.executemany('UPDATE framekms SET ml_claimed_by=NULL, ml_claimed_at=NULL WHERE image_name=? AND ml_claimed_by=?', [(image_name, owner) for image_name in image_names])
+
+    def release_owner(self, owner):
+        # releases every frame still leased by the owner, used on shutdown
+        with self.get_connection() as conn:
+            conn.execute(f'UPDATE framekms SET ml_claimed_by=NULL, ml_claimed_at=NULL WHERE ml_claimed_by=? AND {ML_PENDING}', (owner,))
+
     def get_privacy_config(self):
-        default_values = {
-            'PrivacyModelPath': '/opt/dashcam/bin/n800_1x2_float16.tflite',
-            'PrivacyModelHash': 'aed96116f29ed50e6844e5a5861c3d2316a6d2fb7a00afc4d248da8702d4e434',
-            'PrivacyModelGridPath': '/opt/dashcam/bin/n800_2x2_float16.tflite',
-            'PrivacyModelGridHash': 'e2f5488db4aa6bb0b1dba82476a238ca899c804cbee580f398051d62b7874702',
-            'LowSpeedThreshold': 17,
-            'PrivacyConfThreshold': 0.2,
-            'PrivacyNmsThreshold': 0.9,
-            'PrivacyNumThreads': 4
-        }
-        config = default_values.copy()
-
-        # try:
-        #     with self.get_connection() as conn:
-        #         cursor = conn.cursor()
-        #         for key, default_value in default_values.items():
-        #             cursor.execute('SELECT value FROM config WHERE key = ?', (key,))
-        #             result = cursor.fetchone()
-        #             if result:
-        #                 value = result[0]
-        #                 # Convert to appropriate type based on default value
-        #                 if isinstance(default_value, float):
-        #                     config[key] = float(value)
-        #                 elif isinstance(default_value, int):
-        #                     config[key] = int(value)
-        #                 else:
-        #                     config[key] = str(value).strip('"')
-        # except Exception as e:
-        #     print(e)
+        config = PRIVACY_CONFIG_DEFAULTS.copy()
+
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                keys = list(PRIVACY_CONFIG_DEFAULTS.keys())
+                cursor.execute(f'SELECT key, value FROM config WHERE key IN ({", ".join("?" for _ in keys)})', keys)
+                values = dict(cursor.fetchall())
+        except Exception as e:
+            print(e)
+            return config
+
+        # the Node API persists its own default model path, which this detector doesn't use
+        if str(values.get('PrivacyModelPath', '')).strip('"') in IGNORED_MODEL_PATHS:
+            values.pop('PrivacyModelPath', None)
+            values.pop('PrivacyModelHash', None)
+
+        for key, value in values.items():
+            if value is None:
+                continue
+            default_value = PRIVACY_CONFIG_DEFAULTS[key]
+            try:
+                # Convert to appropriate type based on default value
+                if isinstance(default_value, bool):
+                    config[key] = str(value).strip('"').lower() == 'true'
+                elif isinstance(default_value, float):
+                    config[key] = float(value)
+                elif isinstance(default_value, int):
+                    config[key] = int(float(value))
+                else:
+                    config[key] = str(value).strip('"')
+            except ValueError:
+                print(f"Invalid value for {key}: {value}")
         return config
 
+    def poll_privacy_config(self, config):
+        # Returns the new config if it differs from `config`, None otherwise.
+        # The config table is only queried after another connection committed something
+        data_version = (self._generation, self.get_data_version())
+        if getattr(self._local, 'privacy_config_version', None) == data_version:
+            return None
+        self._local.privacy_config_version = data_version
+
+        new_config = self.get_privacy_config()
+        return new_config if new_config != config else None
+
     def set_error(self, image_name, error):
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -100,35 +435,64 @@ class SQLite:
             conn.commit()
 
     def set_frame_ml(self, image_name, ml_model_hash, ml_detections, metrics = {}):
+        self.set_frames_ml([(image_name, ml_model_hash, ml_detections, metrics)])
+
+    def set_frames_ml(self, results):
+        # results: list of (image_name, ml_model_hash, ml_detections, metrics) tuples
+        # written in a single transaction, so a whole group (or a time window of groups)
+        # costs one commit instead of one per frame
+        self.write_batch(frames_ml=results)
+
+    def write_batch(self, frames_ml=(), errors=(), error_logs=(), releases=(), metrics=()):
+        # Writes everything in one transaction:
+        #   frames_ml: (image_name, ml_model_hash, ml_detections, metrics)
+        #   errors: (image_name, error)
+        #   error_logs: (message, system_time)
+        #   releases: (image_name, owner)
+        #   metrics: (operation, key, started, duration)
+        if not (frames_ml or errors or error_logs or releases or metrics):
+            return
+        now = int(datetime.utcnow().timestamp() * 1000)
+        rows = [self._frame_ml_row(image_name, ml_model_hash, ml_detections, metrics, now) for image_name, ml_model_hash, ml_detections, metrics in frames_ml]
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            now = int(datetime.utcnow().timestamp() * 1000)
-            ml_detections_json = json.dumps(ml_detections)
+            if rows:
+                cursor.executemany(SET_FRAME_ML_QUERY if self.per_frame_metrics else SET_FRAME_ML_RESULT_QUERY, rows)
+            if errors:
+                cursor.executemany('UPDATE framekms SET error=? WHERE image_name=?', [(str(error), image_name) for image_name, error in errors])
+            if error_logs:
+                cursor.executemany('INSERT INTO error_logs (message, service_name, system_time) VALUES (?, ?, ?)', [(str(message), "object-detection", system_time) for message, system_time in error_logs])
+            if releases:
+                cursor.executemany('UPDATE framekms SET ml_claimed_by=NULL, ml_claimed_at=NULL WHERE image_name=? AND ml_claimed_by=?', releases)
+            if metrics:
+                cursor.executemany('INSERT INTO metrics (operation, key, started, duration) VALUES (?, ?, ?, ?)', metrics)
+            conn.commit()
 
-            read_time = metrics.get('read_time', 0)
-            inference_time = metrics.get('inference_time', 0)
-            blur_time = metrics.get('blur_time', 0)
-            write_time = metrics.get('write_time', 0)
+    def _frame_ml_row(self, image_name, ml_model_hash, ml_detections, metrics, now):
+        ml_detections_encoded = encode_detections(ml_detections, self.detections_encoding)
+        if not self.per_frame_metrics:
+            return (ml_model_hash, ml_detections_encoded, now, metrics.get('grid', 0), image_name)
 
-            downscale_time = metrics.get('downscale_time', 0)
-            upscale_time = metrics.get('upscale_time', 0)
-            mask_time = metrics.get('mask_time', 0)
-            composite_time = metrics.get('composite_time', 0)
+        read_time = metrics.get('read_time', 0)
+        inference_time = metrics.get('inference_time', 0)
+        blur_time = metrics.get('blur_time', 0)
+        write_time = metrics.get('write_time', 0)
 
-            load_time = metrics.get('load_time', 0)
-            grid = metrics.get('grid', 0)
-            letterbox_time = metrics.get('letterbox_time', 0)
-            transpose_time = metrics.get('transpose_time', 0)
+        downscale_time = metrics.get('downscale_time', 0)
+        upscale_time = metrics.get('upscale_time', 0)
+        mask_time = metrics.get('mask_time', 0)
+        composite_time = metrics.get('composite_time', 0)
 
-            cursor.execute('UPDATE framekms SET ml_model_hash=?, ml_detections=?, ml_processed_at=?, ml_inference_time=?, ml_read_time=?, ml_blur_time=?, ml_write_time=?, ml_downscale_time=?, ml_upscale_time=?, ml_mask_time=?, ml_composite_time=?, ml_load_time=?, ml_transpose_time=?, ml_letterbox_time=?, ml_grid=? WHERE image_name=?', (ml_model_hash, ml_detections_json, now, inference_time, read_time, blur_time, write_time, downscale_time, upscale_time, mask_time, composite_time, load_time, transpose_time, letterbox_time, grid, image_name))
-            conn.commit()
+        load_time = metrics.get('load_time', 0)
+        grid = metrics.get('grid', 0)
+        letterbox_time = metrics.get('letterbox_time', 0)
+        transpose_time = metrics.get('transpose_time', 0)
+
+        return (ml_model_hash, ml_detections_encoded, now, inference_time, read_time, blur_time, write_time, downscale_time, upscale_time, mask_time, composite_time, load_time, transpose_time, letterbox_time, grid, image_name)
 
     def log_error(self, error):
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            now = datetime.now()
-            cursor.execute('INSERT INTO error_logs (message, service_name, system_time) VALUES (?, ?, ?)', (str(error), "object-detection", now.strftime("%Y-%m-%d %H:%M:%S.00000")))
-            conn.commit()
+        # repeated errors are coalesced by the error sink, see ErrorSink
+        self.write_batch(error_logs=self.error_sink.add(error))
 
     def set_service_status(self, status, service_name = 'object-detection'):
         with self.get_connection() as conn:
@@ -0,0 +1,89 @@
+import bisect
+import threading
+import time
+
+# Log-spaced bucket upper bounds in msecs: 0.1ms .. ~100s with ~12% resolution
+BUCKET_BOUNDS = [0.1 * (1.12 ** i) for i in range(123)]
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, ms):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        # geometric middle of the bucket holding the p-th percentile, capped by the observed max
+        if self.count == 0:
+            return 0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count > 0:
+                if i == 0 or i == len(BUCKET_BOUNDS):
+                    return min(BUCKET_BOUNDS[0], self.max) if i == 0 else self.max
+                return min((BUCKET_BOUNDS[i - 1] * BUCKET_BOUNDS[i]) ** 0.5, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+# Per-stage latency aggregation for the detector (load, infer, nms, blur, encode, db).
+# Workers record into in-process histograms; every flush_interval seconds the percentile
+# summaries are written to the metrics table as (operation='ml_<stage>', key=<stat>,
+# started=<window start>, duration=<value>) rows and the histograms start over
+class StageMetrics:
+    STATS = ['count', 'p50', 'p95', 'p99', 'max']
+
+    def __init__(self, stages=('load', 'infer', 'nms', 'blur', 'encode', 'db'), flush_interval=60):
+        self.stages = list(stages)
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._histograms = {stage: LatencyHistogram() for stage in self.stages}
+        self._started = int(time.time() * 1000)
+        self._started_monotonic = time.monotonic()
+
+    def record(self, stage, ms):
+        with self._lock:
+            if stage not in self._histograms:
+                self.stages.append(stage)
+                self._histograms[stage] = LatencyHistogram()
+            self._histograms[stage].record(ms)
+
+    def summary(self):
+        with self._lock:
+            return {stage: histogram.summary() for stage, histogram in self._histograms.items() if histogram.count}
+
+    def flush(self, writer):
+        # writer is anything with write_metrics(rows), e.g. ResultWriter
+        with self._lock:
+            started = self._started
+            summaries = {stage: histogram.summary() for stage, histogram in self._histograms.items() if histogram.count}
+            self._reset()
+        rows = [('ml_' + stage, stat, started, int(round(summary[stat]))) for stage, summary in summaries.items() for stat in self.STATS]
+        if rows:
+            writer.write_metrics(rows)
+        return summaries
+
+    def maybe_flush(self, writer):
+        if time.monotonic() - self._started_monotonic >= self.flush_interval:
+            return self.flush(writer)
+        return None
@@ -0,0 +1,90 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+# Sleeps of the watcher loops that end as soon as there is something to do: a file or
+# folder showing up in a watched directory (inotify), or `check()` returning True, e.g.
+# when PRAGMA data_version says another connection committed to the db.
+# Without inotify (other OS, no libc symbol, watch limit reached) the directories are
+# polled by their mtime instead, which changes whenever an entry is added or renamed.
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+    return libc if hasattr(libc, 'inotify_init1') and hasattr(libc, 'inotify_add_watch') else None
+
+class Wakeup:
+    def __init__(self, paths=(), check=None, poll_interval=0.05):
+        # `check` is polled every `poll_interval` seconds, as are directories inotify can't watch
+        self.check = check
+        self.poll_interval = poll_interval
+        self.fd = None
+        self.mtimes = {}
+        self.libc = _libc() if paths else None
+        if self.libc is not None:
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            self.fd = fd if fd >= 0 else None
+        for path in paths:
+            self.watch(path)
+
+    def watch(self, path):
+        if self.fd is not None and self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK) >= 0:
+            return
+        print(f'Polling {path} for changes, inotify is not available')
+        self.mtimes[path] = self._mtime(path)
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _polled_change(self):
+        changed = False
+        for path, mtime in self.mtimes.items():
+            current = self._mtime(path)
+            if current != mtime:
+                self.mtimes[path] = current
+                changed = True
+        if self.check is not None and self.check():
+            changed = True
+        return changed
+
+    def _drain(self):
+        # the events themselves don't matter, the caller rescans anyway
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout):
+        # True if woken by a change, False after `timeout` seconds without one
+        deadline = time.monotonic() + timeout
+        polling = self.check is not None or len(self.mtimes) > 0
+        while True:
+            if polling and self._polled_change():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            step = min(remaining, self.poll_interval) if polling else remaining
+            if self.fd is None:
+                time.sleep(step)
+            elif select.select([self.fd], [], [], step)[0]:
+                self._drain()
+                return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
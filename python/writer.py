@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+
+# Write-behind stage for detector results.
+# Inference workers hand their results to a bounded queue instead of writing to SQLite
+# themselves. A single thread drains the queue and coalesces everything that arrives
+# within max_delay seconds (up to max_batch items) into one transaction, so workers never
+# wait for the WAL write lock. When the queue is full producers block; that back-pressure
+# is counted in stats()['stalls'].
+class ResultWriter:
+    def __init__(self, sqlite, max_pending=256, max_batch=64, max_delay=0.5, retries=3, stage_metrics=None):
+        self.sqlite = sqlite
+        self.stage_metrics = stage_metrics
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.retries = retries
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'written': 0,
+            'batches': 0,
+            'dropped': 0,
+            'stalls': 0,
+            'last_batch_ms': 0,
+        }
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+        self._thread.start()
+
+    def set_frames_ml(self, results):
+        if results:
+            self._put(('frames_ml', list(results)))
+
+    def set_error(self, image_name, error):
+        self._put(('errors', [(image_name, str(error))]))
+
+    def log_error(self, error):
+        # coalesced before queueing, so a failure storm can't flood the queue either
+        rows = self.sqlite.error_sink.add(error)
+        if rows:
+            self._put(('error_logs', rows))
+
+    def release_frames(self, image_names, owner):
+        if image_names:
+            self._put(('releases', [(image_name, owner) for image_name in image_names]))
+
+    def write_metrics(self, rows):
+        if rows:
+            self._put(('metrics', list(rows)))
+
+    def pressure(self):
+        # fraction of the queue in use, 1.0 means producers are blocked
+        return self._queue.qsize() / self._queue.maxsize
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+    def close(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _put(self, item):
+        if self._stopped:
+            raise RuntimeError('ResultWriter is closed')
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['stalls'] += 1
+            self._queue.put(item)
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=1)
+            except queue.Empty:
+                # idle: write the repeat summaries of a finished error window
+                self._write({'error_logs': self.sqlite.error_sink.collect()})
+                continue
+            items = [item]
+            deadline = time.monotonic() + self.max_delay
+            # coalesce whatever arrives within the window into the same transaction
+            while item is not None and len(items) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                items.append(item)
+
+            batch = {'frames_ml': [], 'errors': [], 'error_logs': [], 'releases': [], 'metrics': []}
+            for entry in items:
+                if entry is not None:
+                    kind, rows = entry
+                    batch[kind].extend(rows)
+
+            self._write(batch)
+            for _ in items:
+                self._queue.task_done()
+
+            if items[-1] is None:
+                self._write({'error_logs': self.sqlite.error_sink.collect(force=True)})
+                return
+
+    def _write(self, batch):
+        count = sum(len(rows) for rows in batch.values())
+        if count == 0:
+            return
+        for attempt in range(self.retries):
+            try:
+                start = time.perf_counter()
+                self.sqlite.write_batch(**batch)
+                elapsed = (time.perf_counter() - start) * 1000
+                if self.stage_metrics:
+                    self.stage_metrics.record('db', elapsed)
+                with self._stats_lock:
+                    self._stats['written'] += count
+                    self._stats['batches'] += 1
+                    self._stats['last_batch_ms'] = int(elapsed)
+                return
+            except Exception as e:
+                print(f"Error writing results (attempt {attempt + 1}): {e}")
+                time.sleep(0.5 * (attempt + 1))
+        # frames whose results got lost stay pending and are claimed again once their lease expires
+        with self._stats_lock:
+            self._stats['dropped'] += count
@@ -44,15 +44,35 @@ def compute_iou(box, boxes):
     return iou
 
 
-def xywh2xyxy(x):
+def xywh2xyxy(x, out=None):
     # Convert bounding box (x, y, w, h) to bounding box (x1, y1, x2, y2)
-    y = np.copy(x)
+    # out, if given, receives the result and must not share memory with x
+    y = np.copy(x) if out is None else out
     y[..., 0] = x[..., 0] - x[..., 2] / 2
     y[..., 1] = x[..., 1] - x[..., 3] / 2
     y[..., 2] = x[..., 0] + x[..., 2] / 2
     y[..., 3] = x[..., 1] + x[..., 3] / 2
     return y
 
+def decode_predictions(output, conf_threshold, multiplier=1):
+    # Decode a raw YOLOv8 head, shaped (4 + num_classes, num_anchors), in one pass
+    # Returns an (N, 6) float32 array of [class_id, score, x1, y1, x2, y2] rows
+    class_scores = output[4:]
+    max_scores = np.max(class_scores, axis=0)
+    mask = max_scores >= conf_threshold
+
+    predictions = np.empty((np.count_nonzero(mask), 6), dtype=np.float32)
+    if len(predictions) == 0:
+        return predictions
+
+    # argmax only over anchors that passed the threshold
+    predictions[:, 0] = np.argmax(class_scores[:, mask], axis=0)
+    predictions[:, 1] = max_scores[mask]
+    xywh2xyxy(output[:4, mask].T.astype(np.float32), out=predictions[:, 2:6])
+    if multiplier != 1:
+        predictions[:, 2:6] *= multiplier
+    return predictions
+
 def xyxyxywh2(x):
     # Convert bounding box (x1, y1, x2, y2) to bounding box (cx, cy, w, h)
     y = np.copy(x)
@@ -176,6 +176,11 @@ export const performSoftMigrations = async (): Promise<void> => {
     `ALTER TABLE packed_framekms ADD COLUMN heading INTEGER DEFAULT 0;`,
     `ALTER TABLE framekms ADD COLUMN retry INTEGER DEFAULT 0;`,
     `ALTER TABLE packed_framekms ADD COLUMN retry INTEGER DEFAULT 0;`,
+    // frame leases of the object-detection service
+    `ALTER TABLE framekms ADD COLUMN ml_claimed_by TEXT;`,
+    `ALTER TABLE packed_framekms ADD COLUMN ml_claimed_by TEXT;`,
+    `ALTER TABLE framekms ADD COLUMN ml_claimed_at INTEGER;`,
+    `ALTER TABLE packed_framekms ADD COLUMN ml_claimed_at INTEGER;`,
     // Add more ALTER TABLE commands here as needed
   ];
 
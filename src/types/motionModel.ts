@@ -53,6 +53,18 @@ export type SystemConfig = {
   PrivacyConfThreshold?: number;
   PrivacyNmsThreshold?: number;
   PrivacyNumThreads?: number;
+  PrivacyTfliteThreads?: number;
+  PrivacyTfliteXnnpack?: boolean;
+  PrivacyAutotune?: boolean;
+  PrivacyBacklogDrainSeconds?: number;
+  PrivacyDecodeThreads?: number;
+  PrivacyPostThreads?: number;
+  PrivacyPrefetchFrames?: number;
+  PrivacyDetectionsEncoding?: 'json' | 'packed';
+  PrivacyBlurMode?: 'pixel' | 'dct';
+  PrivacyJpegEncoder?: 'pil' | 'cv2' | 'turbojpeg';
+  PrivacyFsync?: boolean;
+  PrivacyPerFrameMetrics?: boolean;
   SpeedToIncreaseDx?: number;
   HdcSwappiness?: number;
   HdcsSwappiness?: number;
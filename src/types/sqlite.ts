@@ -101,7 +101,7 @@ export type FrameKmRecord = {
     dilution: number;
     created_at?: number;
     ml_model_hash?: string;
-    ml_detections?: string;
+    ml_detections?: string | Buffer;
     ml_sign_detections?: string;
     angles?: string;
     ml_read_time?: number;
@@ -117,6 +117,8 @@ export type FrameKmRecord = {
     ml_transpose_time?: number;
     ml_letterbox_time?: number;
     ml_grid?: number;
+    ml_claimed_by?: string;
+    ml_claimed_at?: number;
     frame_idx?: number;
     postponed?: number;
     orientation?: number;
@@ -288,10 +288,50 @@ export const getDetectionsByFrame = async (name: string, framesMetadata: FrameKM
   return privacyDetections;
 }
 
+const float16ToNumber = (bits: number) => {
+  const sign = bits & 0x8000 ? -1 : 1;
+  const exponent = (bits >> 10) & 0x1f;
+  const fraction = bits & 0x3ff;
+  if (exponent === 0) {
+    return sign * Math.pow(2, -14) * (fraction / 1024);
+  }
+  if (exponent === 0x1f) {
+    return fraction ? NaN : sign * Infinity;
+  }
+  return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+};
+
+/**
+ * Decodes the packed ml_detections format written by python/sqlite.py (encode_detections):
+ * 'DET' + version byte + uint16 count, then per detection 4 x int16 box, uint8 class, float16 score
+ */
+export const decodePackedDetections = (buf: Buffer) => {
+  const HEADER_SIZE = 6;
+  const DETECTION_SIZE = 11;
+  if (buf.length < HEADER_SIZE || buf.toString('latin1', 0, 3) !== 'DET' || buf[3] !== 1) {
+    throw new Error('Unsupported detections encoding');
+  }
+  const count = buf.readUInt16LE(4);
+  const detections = [];
+  for (let i = 0; i < count; i++) {
+    const offset = HEADER_SIZE + i * DETECTION_SIZE;
+    const box = [
+      buf.readInt16LE(offset),
+      buf.readInt16LE(offset + 2),
+      buf.readInt16LE(offset + 4),
+      buf.readInt16LE(offset + 6),
+    ];
+    detections.push([box, float16ToNumber(buf.readUInt16LE(offset + 9)), buf[offset + 8]]);
+  }
+  return detections;
+};
+
 export const sanitizeDetections = (ml_detections: any) => {
   let detections = [];
   try {
-    detections = JSON.parse(ml_detections || '[]');
+    detections = Buffer.isBuffer(ml_detections)
+      ? decodePackedDetections(ml_detections)
+      : JSON.parse(ml_detections || '[]');
   } catch (e: unknown) {
     console.log('Error parsing detections');
   }